@@ -0,0 +1,163 @@
+'''
+Armed booking mode. Logins, scraping, ranking and building every booking request happen
+ahead of time, then all submissions are fired at once when the booking window opens.
+'''
+import time
+import datetime as dt
+from dataclasses import dataclass
+import pytz
+
+import run_trace
+from bookV2 import BOOKED, booking_date, booking_params, claim_cached, get_credentials, get_index, session_pool, submit_outcome, verify_bookings
+from planner import plan
+from ranking import get_ranker
+
+PACIFIC = pytz.timezone('US/Pacific')
+# Stop sleeping and busy wait for the last stretch before firing
+SPIN_SECONDS = 0.05
+# A fire time passed this recently is still today's, fire straight away
+FIRE_GRACE = dt.timedelta(minutes=5)
+# Seconds a run needs after firing to submit, verify and report
+FIRE_MARGIN = 60
+
+
+@dataclass
+class Submission:
+    """ A pre-built booking request and, once fired, how it went. """
+    cell: object
+    user: dict
+    params: dict
+    auth: object = None
+    # Wall clock time the request was sent
+    sent_at: float = None
+    # Seconds until the response came back
+    elapsed: float = None
+    status: int = None
+    ok: bool = False
+    error: str = None
+    # Whether the booking showed up on the day page afterwards, None until checked
+    confirmed: bool = None
+    booking_id: int = None
+
+    def __repr__(self):
+        if self.sent_at is None:
+            return f"{self.cell} as {self.user['username']} (not sent)"
+        result = "booked" if self.ok else f"failed ({self.error})"
+        if self.confirmed is not None:
+            result += " (confirmed)" if self.confirmed else " (NOT on the page)"
+        return f"{self.cell} as {self.user['username']} {result} in {self.elapsed * 1000:.0f}ms"
+
+
+def next_instant(time_str, now=None, grace=FIRE_GRACE):
+    """
+    Return the next Pacific datetime at 'HH:MM' or 'HH:MM:SS'. If that time passed today
+    less than 'grace' ago it's returned as is, so a run starting a little late fires at
+    once, otherwise the instant is tomorrow.
+    """
+    parts = list(map(int, time_str.split(':')))
+    hour, minute, second = (parts + [0, 0])[:3]
+
+    now = now or dt.datetime.now(PACIFIC)
+    instant = PACIFIC.localize(dt.datetime.combine(now.date(), dt.time(hour, minute, second)))
+    if instant < now - grace:
+        instant = PACIFIC.localize(dt.datetime.combine(now.date() + dt.timedelta(days=1), dt.time(hour, minute, second)))
+    return instant
+
+
+def can_wait(instant, time_left):
+    """ Whether a run with 'time_left' seconds left can wait for 'instant' and still book. """
+    return time_left is None or instant.timestamp() - time.time() + FIRE_MARGIN <= time_left
+
+
+def wait_until(instant):
+    """ Block until 'instant' (an aware datetime). Sleeps most of the way then spins. """
+    target = instant.timestamp()
+    while True:
+        remaining = target - time.time()
+        if remaining <= 0:
+            return
+        if remaining > SPIN_SECONDS:
+            time.sleep(remaining - SPIN_SECONDS)
+
+
+def prepare(offset, windows, pool=None):
+    """
+    Scrape, rank and log in for every (start, end) window 'offset' days in the future and
+    return the Submissions ready to be fired.
+    """
+    if pool is None:
+        pool = session_pool
+    date = booking_date(offset)
+
+    creds = get_credentials()
+    users = creds.login['users']
+
+    # Work out which account books what before anyone logs in
+    assignments = plan(get_index(offset), windows, users, score=get_ranker().score)
+
+    submissions = []
+    for assignment in assignments:
+        cell, user = assignment.cell, assignment.user
+        auth = pool.get(user, date, cell.area)
+        if auth is None:
+            print(f"Login for user {user} failed")
+            continue
+        params = booking_params(cell, date, user, creds.group_names)
+        submissions.append(Submission(cell, user, params, auth))
+
+    return submissions
+
+
+def send(submission):
+    """ Post a single prepared submission and record its timing and outcome. """
+    submission.sent_at = time.time()
+    started = time.perf_counter()
+    try:
+        resp = submission.auth.submit(submission.params)
+    except Exception as e:
+        submission.elapsed = time.perf_counter() - started
+        submission.error = repr(e)
+        return submission
+    submission.elapsed = time.perf_counter() - started
+    submission.status = resp.status_code
+
+    outcome = submit_outcome(resp)
+    if outcome == BOOKED:
+        submission.ok = True
+    else:
+        submission.error = outcome
+    return submission
+
+
+def fire(submissions):
+    """ Send every submission at the same time. """
+    if not submissions:
+        return []
+    with run_trace.ThreadPoolExecutor(max_workers=len(submissions)) as pool:
+        return list(pool.map(send, submissions))
+
+
+@run_trace.traced
+def arm(offset, windows, fire_at):
+    """
+    Get everything ready for booking 'offset' days in the future, wait for 'fire_at'
+    (an aware datetime) and then submit every booking concurrently.
+    """
+
+    # Work the date out now, the day rolls over while we wait for midnight
+    date = booking_date(offset)
+    submissions = prepare(offset, windows)
+    if not submissions:
+        return "No rooms found"
+
+    print(f"Armed {len(submissions)} bookings, firing at {fire_at}")
+    wait_until(fire_at)
+    results = fire(submissions)
+    for submission in results:
+        if submission.ok:
+            claim_cached(date, submission.cell, submission.params["name"])
+    # Only now, with everything sent, see what actually landed
+    verify_bookings(date, [submission for submission in results if submission.ok])
+    for submission in results:
+        print(submission)
+    return results
@@ -0,0 +1,129 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+from utils import DayGrid
+
+# Seconds a scraped page is trusted for
+DEFAULT_TTL = 30
+# Pages kept at once, the least recently used go first
+DEFAULT_MAX_PAGES = 64
+
+
+class AvailabilityCache():
+    """
+    Short lived cache of scraped pages keyed by (date, area), holding either a DayGrid or
+    a list of cells. Expired pages are dropped when looked up and the least recently used
+    ones are evicted once there are more than 'max_pages'.
+
+    DayGrids are never changed once cached (update stores a new one), so they're
+    handed out as they are. Lists are copied cell by cell, so editing them never changes
+    what's in the cache.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, clock=time.monotonic, max_pages=DEFAULT_MAX_PAGES):
+        self.ttl = ttl
+        self.max_pages = max_pages
+        self._clock = clock
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        # (date, area) -> lock held while that page is being loaded by get_or_load
+        self._loading = {}
+
+    @staticmethod
+    def _copies(page):
+        if isinstance(page, DayGrid):
+            return page
+        return [copy.copy(cell) for cell in page]
+
+    def _lookup(self, key):
+        """ The page stored under 'key' if it's still fresh. Call with the lock held. """
+        entry = self._pages.get(key)
+        if entry is None:
+            return None
+        stored_at, page = entry
+        if self._clock() - stored_at > self.ttl:
+            del self._pages[key]
+            return None
+        self._pages.move_to_end(key)
+        return page
+
+    def _store(self, key, page):
+        """ Call with the lock held. """
+        self._pages[key] = (self._clock(), page)
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def get(self, date, area):
+        """ Return the page for (date, area) (see _copies), or None if missing or expired. """
+        with self._lock:
+            page = self._lookup((date, area))
+        return None if page is None else self._copies(page)
+
+    def get_or_load(self, date, area, load):
+        """
+        Return the cached page itself for (date, area), calling 'load' to get and cache it
+        when it's missing. Nothing is copied, so don't modify what you get back. Concurrent
+        callers asking for the same page share one load.
+        """
+        key = (date, area)
+        with self._lock:
+            page = self._lookup(key)
+            if page is not None:
+                return page
+            loading = self._loading.setdefault(key, threading.Lock())
+
+        with loading:
+            # Someone else may have loaded it while we waited
+            with self._lock:
+                page = self._lookup(key)
+            if page is None:
+                page = load()
+                with self._lock:
+                    self._store(key, page)
+        with self._lock:
+            self._loading.pop(key, None)
+        return page
+
+    def put(self, date, area, cells):
+        """ Cache the page for (date, area) and return it like get. """
+        if not isinstance(cells, DayGrid):
+            cells = list(cells)
+        with self._lock:
+            self._store((date, area), cells)
+        return self._copies(cells)
+
+    def invalidate(self, date, area=None):
+        """ Drop the page for (date, area), or every page on 'date' if area is None. """
+        with self._lock:
+            for key in [k for k in self._pages if k[0] == date and area in (None, k[1])]:
+                del self._pages[key]
+
+    def update(self, date, area, change):
+        """
+        Replace the cached page for (date, area), if there is one, with 'change(page)'. It keeps
+        the old page's age. 'change' must return a new page rather than edit the one it's given,
+        someone may be reading that one.
+        """
+        with self._lock:
+            entry = self._pages.get((date, area))
+            if entry is not None:
+                stored_at, page = entry
+                self._pages[(date, area)] = (stored_at, change(page))
+
+    def invalidate_cells(self, date, area, predicate):
+        """
+        Drop the cached cells on (date, area) matching 'predicate'. The rest of the page stays
+        cached.
+        """
+        def drop(page):
+            if isinstance(page, DayGrid):
+                return page.without(predicate)
+            return [c for c in page if not predicate(c)]
+        self.update(date, area, drop)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
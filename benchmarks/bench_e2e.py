@@ -0,0 +1,154 @@
+'''
+End to end booking benchmark against the local stand-in site (see standin_server.py).
+
+Usage: python benchmarks/bench_e2e.py [latency ms] [runs]
+
+Reports for the V2 pipeline: booking latency from scrape to last submission, day pages
+scraped and parsed per second, and peak memory of a booking run. The legacy book.py path is
+run once for comparison, timed and then again for its peak memory. It only books the first
+window, so it does less work than a V2 run.
+'''
+import io
+import os
+import sys
+import json
+import time
+import base64
+import shutil
+import tempfile
+import statistics
+import contextlib
+import tracemalloc
+import datetime as dt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import standin_server
+
+USERS = ["alice", "bob", "carol"]
+# 10:00 - 13:00 and 14:30 - 16:30
+WINDOWS = [(36000, 46800), (52200, 59400)]
+
+
+def write_config(directory):
+    """ Config files for the fake accounts. The stand-in accepts any password. """
+    users = [{"username": u, "password": base64.standard_b64encode(b"hunter2").decode()} for u in USERS]
+    with open(os.path.join(directory, "login.json"), "w") as f:
+        json.dump({"users": users}, f)
+    with open(os.path.join(directory, "group_names.json"), "w") as f:
+        json.dump({"names": ["Benchmark Group"]}, f)
+
+
+def reset(server, bookV2, keep_sessions=False):
+    import http_client
+    server.site.reset(keep_sessions)
+    if not keep_sessions:
+        bookV2.session_pool.store.clear()
+    # Every run starts with a full rate limit budget, like a fresh Lambda invocation
+    http_client._buckets.clear()
+    bookV2.session_pool.clear()
+    bookV2.availability_cache.clear()
+
+
+def bench_v2_booking(server, bookV2, runs, keep_sessions=False):
+    """
+    Seconds per full plan and book run with an empty cache, from cold sessions or with
+    'keep_sessions' from ones stored by the last run (a cold start on a reused /tmp).
+    """
+    samples = []
+    for _ in range(runs):
+        reset(server, bookV2, keep_sessions)
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            bookV2.book_windows(7, WINDOWS)
+        samples.append(time.perf_counter() - started)
+    return samples, len(server.site.bookings), server.site.requests
+
+
+def bench_v2_pages(server, bookV2, pages=24):
+    """ Day pages scraped and parsed per second with the default concurrency. """
+    date = bookV2.booking_date(7)
+    targets = [(date.day, date.month, date.year, 1 + i % 3) for i in range(pages)]
+    started = time.perf_counter()
+    bookV2.scrape_many(targets, fresh=True)
+    return pages / (time.perf_counter() - started)
+
+
+def bench_v2_memory(server, bookV2):
+    """ Peak bytes allocated during one booking run. """
+    reset(server, bookV2)
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        bookV2.book_windows(7, WINDOWS)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def legacy_run(server):
+    """ One legacy scrapeAndBook run of the first window, from a clean site and cache. """
+    import book
+    book.urlBase = server.url + "/studyrooms/"
+    server.site.reset()
+    book.booked.clear()
+    book.availability_cache.clear()
+    start, end = (dt.time(hour=int(s // 3600), minute=int(s % 3600 // 60)) for s in WINDOWS[0])
+    with contextlib.redirect_stdout(io.StringIO()):
+        book.scrapeAndBook(7, start, end, 1, [15, 14, 13, 12, 16, 11, 10, 9, 8])
+
+
+def bench_legacy(server):
+    """ Seconds for one legacy booking run. """
+    started = time.perf_counter()
+    legacy_run(server)
+    return time.perf_counter() - started, len(server.site.bookings), server.site.requests
+
+
+def bench_legacy_memory(server):
+    """ Peak bytes allocated during one legacy booking run. """
+    tracemalloc.start()
+    legacy_run(server)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(latency_ms=50, runs=5):
+    workdir = tempfile.mkdtemp()
+    write_config(workdir)
+    # Keep the benchmark's booking outcomes out of the real ranking history
+    os.environ["BOOKINGBOT_HISTORY"] = os.path.join(workdir, "history.json")
+    os.environ["BOOKINGBOT_ROOMS"] = os.path.join(workdir, "rooms.json")
+    os.chdir(workdir)
+    try:
+        import bookV2
+        import session_store
+        bookV2.session_pool.store = session_store.MemoryStore()
+        server = standin_server.serve(latency=latency_ms / 1000)
+        bookV2.set_site(server.url + "/studyrooms/", server.url + "/cas/login")
+
+        print(f"Stand-in latency {latency_ms}ms, {len(USERS)} accounts, windows {WINDOWS}")
+        samples, bookings, requests = bench_v2_booking(server, bookV2, runs)
+        print(f"V2 booking run      median {statistics.median(samples) * 1000:8.1f}ms  "
+              f"min {min(samples) * 1000:8.1f}ms  ({bookings} bookings, {requests} requests)")
+        samples, bookings, requests = bench_v2_booking(server, bookV2, runs, keep_sessions=True)
+        print(f"V2 stored sessions  median {statistics.median(samples) * 1000:8.1f}ms  "
+              f"min {min(samples) * 1000:8.1f}ms  ({bookings} bookings, {requests} requests)")
+        print(f"V2 pages/second     {bench_v2_pages(server, bookV2):8.1f}")
+        v2_peak = bench_v2_memory(server, bookV2)
+
+        elapsed, bookings, requests = bench_legacy(server)
+        print(f"Legacy booking run  {elapsed * 1000:8.1f}ms  ({bookings} bookings, {requests} requests)")
+        print(f"V2 peak memory      {v2_peak / 1024:8.0f}KiB  (legacy {bench_legacy_memory(server) / 1024:.0f}KiB)")
+        server.shutdown()
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main(
+        float(sys.argv[1]) if len(sys.argv) > 1 else 50,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    )
@@ -0,0 +1,46 @@
+'''
+Tracks Lambda cold start cost: how long importing the handler and what the first invocation
+pulls in takes, each measured in a fresh interpreter.
+
+Usage: python benchmarks/bench_import.py [runs]
+
+Prints the median cumulative import time per module in milliseconds, using python -X importtime.
+'''
+import os
+import sys
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What a cold start imports, in order: the handler itself, our booking code on the first
+# invocation, then the dependencies that only load once the run needs them
+MODULES = ["lambda_function", "room_snag", "bookV2", "pytz", "requests", "lxml.html", "bs4"]
+
+
+def import_times(module):
+    """ Cumulative import time in microseconds of every module loaded by importing 'module'. """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main(runs=5):
+    print(f"{'module':<18} {'ms':>8}")
+    for module in MODULES:
+        samples = [import_times(module).get(module, 0) / 1000 for _ in range(runs)]
+        print(f"{module:<18} {statistics.median(samples):>8.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
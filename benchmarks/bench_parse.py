@@ -0,0 +1,68 @@
+'''
+Compares the day_main parser backends against the saved day pages in benchmarks/fixtures.
+
+Usage: python benchmarks/bench_parse.py [repeats]
+
+For every fixture and backend it prints the mean parse time per page and the peak memory
+allocated while parsing it, and checks every backend returns the same cells as BeautifulSoup.
+'''
+import os
+import sys
+import glob
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bookV2
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_fixtures():
+    """ Return (name, html, area) for every saved day page. Area is taken from the file name. """
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "day_area*.html"))):
+        name = os.path.splitext(os.path.basename(path))[0]
+        area = int(name.split("_")[1][len("area"):])
+        with open(path) as f:
+            pages.append((name, f.read(), area))
+    return pages
+
+
+def time_parse(parser, html, area, repeats):
+    """ Mean seconds per parse over 'repeats' runs. """
+    started = time.perf_counter()
+    for _ in range(repeats):
+        parser(html, area, 1)
+    return (time.perf_counter() - started) / repeats
+
+
+def peak_memory(parser, html, area):
+    """ Peak bytes allocated during a single parse. """
+    tracemalloc.start()
+    parser(html, area, 1)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def same_cells(a, b):
+    fields = lambda cell: tuple(getattr(cell, name) for name in bookV2.Cell.__slots__)
+    return [fields(x) for x in a] == [fields(x) for x in b]
+
+
+def main(repeats=50):
+    reference = bookV2.PARSERS["bs4"]
+    print(f"{'page':<20} {'parser':<8} {'cells':>6} {'ms/page':>9} {'peak KiB':>9}  match")
+    for name, html, area in load_fixtures():
+        expected = reference(html, area, 1)
+        for backend, parser in bookV2.PARSERS.items():
+            cells = parser(html, area, 1)
+            ms = time_parse(parser, html, area, repeats) * 1000
+            peak = peak_memory(parser, html, area) / 1024
+            match = "ok" if same_cells(cells, expected) else "MISMATCH"
+            print(f"{name:<20} {backend:<8} {len(cells):>6} {ms:>9.2f} {peak:>9.0f}  {match}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
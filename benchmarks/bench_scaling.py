@@ -0,0 +1,142 @@
+'''
+How the filtering, merging and ranking steps scale, on made up day pages (see synthetic.py)
+of growing size.
+
+Usage: python benchmarks/bench_scaling.py [repeats]
+
+Sweeps the number of rooms, days and how busy the rooms are. For every size and stage it prints
+the best time of 'repeats' runs, the time per cell and the peak memory allocated. 'growth' is
+how the time grew against the size before it: about 1 for linear, 2 for quadratic. It's left
+out of the occupancy sweep, where the number of cells only changes by how busy rooms are.
+
+Stages, each run on the output of the one before like a booking run does:
+
+- parse             parse_day on every page
+- get_unbooked      the free cells, from the Cell lists and from DayGrids, and the positions
+                    of the free cells in the DayGrids without making any cells
+- get_within_times  the free cells inside the requested window, the same three ways
+- dedup             get_available, dropping repeated (room, day, time) cells
+- merge             per day, a SlotIndex of the free cells and the plan_window covering the
+                    window. The grid version builds the index straight from the DayGrids
+                    like get_requested_times does after scraping
+- sort_by_prefrence the free cells in the window, longest and best first
+'''
+import os
+import sys
+import math
+import time
+import shutil
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic
+
+# 10:00 - 16:00
+WINDOW = (36000, 57600)
+
+# (what's swept, [make_days arguments for each size], whether to report growth)
+SWEEPS = [
+    ("rooms", [dict(rooms=rooms, days=1, areas=1) for rooms in (9, 36, 144, 576)], True),
+    ("days", [dict(rooms=9, days=days, areas=2) for days in (1, 7, 28, 112)], True),
+    ("occupancy", [dict(rooms=36, days=7, areas=2, occupancy=occupancy) for occupancy in (0.1, 0.5, 0.9)], False),
+]
+
+
+def stages(days):
+    """ (name, function) for every stage, each taking what the one before returned. """
+    import bookV2
+    from planner import plan_window
+    from utils import FREE, DayGrid, SlotIndex, get_available, get_unbooked, get_within_times, sort_by_prefrence
+
+    start, end = WINDOW
+    pages = [(day.html(), day.area, day.day) for day in days]
+    cells = [cell for day in days for cell in day.cells()]
+    grids = [DayGrid.from_cells(day.cells(), day.area, day.day, bookV2.Cell) for day in days]
+    free = list(get_unbooked(cells))
+    within = list(get_within_times(free, start, end))
+
+    def merge(cells):
+        by_day = {}
+        for cell in cells:
+            by_day.setdefault(cell.day, []).append(cell)
+        return [plan_window(SlotIndex.from_cells(day_cells), start, end) for day_cells in by_day.values()]
+
+    def merge_grids(grids):
+        by_day = {}
+        for grid in grids:
+            by_day.setdefault(grid.day, []).append(grid)
+        return [plan_window(SlotIndex.from_grids(day_grids), start, end) for day_grids in by_day.values()]
+
+    return len(cells), [
+        ("parse", lambda: [bookV2.parse_day(*page) for page in pages]),
+        ("get_unbooked", lambda: list(get_unbooked(cells))),
+        ("get_unbooked grid", lambda: [list(get_unbooked(grid)) for grid in grids]),
+        ("get_unbooked positions", lambda: [grid.positions(FREE) for grid in grids]),
+        ("get_within_times", lambda: list(get_within_times(free, start, end))),
+        ("get_within_times grid", lambda: [list(get_within_times(grid, start, end)) for grid in grids]),
+        ("get_within_times positions", lambda: [grid.positions(start=start, end=end) for grid in grids]),
+        ("dedup", lambda: get_available(cells)),
+        ("merge", lambda: merge(free)),
+        ("merge grid", lambda: merge_grids(grids)),
+        ("sort_by_prefrence", lambda: sort_by_prefrence(list(within))),
+    ]
+
+
+def best_time(run, repeats):
+    """ Fastest of 'repeats' runs in seconds, after one untimed run for imports and caches. """
+    run()
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def peak_memory(run):
+    """ Peak bytes allocated during a single run. """
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def growth(previous, current):
+    """ Exponent k in time ~ cells ** k between two sizes, None if it can't be told. """
+    if previous is None:
+        return None
+    (cells_before, time_before), (cells_now, time_now) = previous, current
+    if cells_now == cells_before or min(time_before, time_now) <= 0:
+        return None
+    return math.log(time_now / time_before) / math.log(cells_now / cells_before)
+
+
+def main(repeats=5):
+    workdir = tempfile.mkdtemp()
+    # The made up rooms stay out of the real room catalog
+    os.environ["BOOKINGBOT_ROOMS"] = os.path.join(workdir, "rooms.json")
+    try:
+        for swept, sizes, scaling in SWEEPS:
+            print(f"\nSweeping {swept}")
+            print(f"{'size':<42} {'stage':<26} {'cells':>7} {'ms':>9} {'us/cell':>8} {'peak KiB':>9} {'growth':>7}")
+            previous = {}
+            for size in sizes:
+                days = synthetic.make_days(**size)
+                label = ", ".join(f"{key} {value}" for key, value in size.items())
+                cells, runs = stages(days)
+                for name, run in runs:
+                    elapsed = best_time(run, repeats)
+                    peak = peak_memory(run)
+                    k = growth(previous.get(name), (cells, elapsed)) if scaling else None
+                    previous[name] = (cells, elapsed)
+                    print(f"{label:<42} {name:<26} {cells:>7} {elapsed * 1000:>9.2f} {elapsed / cells * 1e6:>8.3f} "
+                          f"{peak / 1024:>9.0f} {'' if k is None else f'{k:.2f}':>7}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
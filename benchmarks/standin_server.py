@@ -0,0 +1,218 @@
+'''
+A local stand-in for the study room site and CAS login, serving the saved pages in
+benchmarks/fixtures so the booking code can be run end to end without touching UVic.
+
+Usage: python benchmarks/standin_server.py [port] [latency ms]
+
+Every response is delayed by 'latency' to imitate the round trip to the real site.
+'''
+import os
+import re
+import sys
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# Seconds an account may book per day, like the real site
+DAILY_LIMIT = 7200
+SESSION_COOKIE = "MRBS_SESSID"
+# A free cell on a day page, with its room and start time
+NEW_CELL_RE = re.compile(
+    rb'<td class="new"><div class="celldiv slots1"><a href="edit_entry\.php\?area=\d+&amp;room=(\d+)&amp;hour=(\d+)&amp;minute=(\d+)[^"]*"></a></div></td>'
+)
+# Ids handed out to bookings made on the stand-in
+FIRST_BOOKING_ID = 90000
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+class StandInSite():
+    """ Pages served by the stand-in and the bookings made against it. """
+
+    def __init__(self, latency=0.0, day_pages=None):
+        self.latency = latency
+        # area -> day page fixture
+        self.day_pages = day_pages or {1: "day_area1_busy.html", 2: "day_area2_quiet.html", 3: "day_area3_busy.html"}
+        self.pages = {name: load_fixture(name) for name in os.listdir(FIXTURES) if name.endswith(".html")}
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, keep_sessions=False):
+        """ Forget all bookings, and logins too unless 'keep_sessions'. """
+        with self.lock:
+            # session id -> username
+            if not keep_sessions or not hasattr(self, "sessions"):
+                self.sessions = {}
+            # (username, date) -> seconds booked that day
+            self.booked = {}
+            # (username, seconds, room id, start seconds, group name, date) for each booking,
+            # dates as "YYYY-MM-DD"
+            self.bookings = []
+            self.requests = 0
+
+    def login(self, username):
+        with self.lock:
+            session_id = f"{username}-{len(self.sessions)}"
+            self.sessions[session_id] = username
+            return session_id
+
+    def book(self, username, seconds, room=None, start=None, name=None, date=None):
+        """
+        Record a booking on 'date'. Returns "maxed" if it would take the account over its
+        limit for that day, "conflict" if the room is already booked then and None if it
+        went through.
+        """
+        with self.lock:
+            if self.booked.get((username, date), 0) + seconds > DAILY_LIMIT:
+                return "maxed"
+            if room is not None:
+                for _, other_seconds, other_room, other_start, _, other_date in self.bookings:
+                    if (other_date == date and other_room == room
+                            and other_start < start + seconds and start < other_start + other_seconds):
+                        return "conflict"
+            self.booked[(username, date)] = self.booked.get((username, date), 0) + seconds
+            self.bookings.append((username, seconds, room, start, name, date))
+            return None
+
+    def day_page(self, area, date=None):
+        """ The day page fixture for 'area' with the bookings made on 'date' so far filled in. """
+        with self.lock:
+            bookings = [(i, b) for i, b in enumerate(self.bookings) if b[2] is not None and b[5] == date]
+
+        def fill(match):
+            room, time = int(match.group(1)), int(match.group(2)) * 3600 + int(match.group(3)) * 60
+            for i, (_, seconds, booked_room, start, name, _) in bookings:
+                if booked_room == room and start <= time < start + seconds:
+                    booking_id = FIRST_BOOKING_ID + i
+                    return (
+                        f'<td class="booked"><div class="celldiv slots1"><a href="view_entry.php?id={booking_id}" '
+                        f'data-id="{booking_id}" data-type="I">{name}</a></div></td>'
+                    ).encode()
+            return match.group(0)
+        return NEW_CELL_RE.sub(fill, self.pages[self.day_pages[area]])
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def site(self):
+        return self.server.site
+
+    def log_message(self, *args):
+        pass
+
+    def username(self):
+        cookies = dict(
+            part.strip().split("=", 1) for part in self.headers.get("Cookie", "").split(";") if "=" in part
+        )
+        return self.site.sessions.get(cookies.get(SESSION_COOKIE))
+
+    @staticmethod
+    def date(fields):
+        """ The day/month/year in a query or legacy form as "YYYY-MM-DD", None if there isn't one. """
+        try:
+            return f"{int(fields['year']):04}-{int(fields['month']):02}-{int(fields['day']):02}"
+        except (KeyError, ValueError):
+            return None
+
+    def form(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+
+    def send(self, status, body=b"", headers=None):
+        time.sleep(self.site.latency)
+        with self.site.lock:
+            self.site.requests += 1
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        pages = self.site.pages
+
+        if url.path == "/cas/login":
+            self.send(200, pages["cas_login.html"])
+        elif url.path == "/studyrooms/index.php":
+            area = int(query.get("area", 1))
+            if area not in self.site.day_pages:
+                return self.send(404)
+            page = self.site.day_page(area, self.date(query))
+            etag = '"%s"' % hashlib.md5(page).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                return self.send(304, headers={"ETag": etag})
+            self.send(200, page, {"ETag": etag})
+        elif url.path == "/studyrooms/day.php":
+            # Page layout the legacy book.py scraper understands
+            self.send(200, pages["legacy_day_area1.html"])
+        elif url.path == "/studyrooms/edit_entry.php":
+            self.send(200, pages["edit_entry.html"] if self.username() else pages["edit_entry_login.html"])
+        else:
+            self.send(404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        form = self.form()
+
+        if url.path == "/cas/login":
+            # Log in and bounce back to the service, like CAS does
+            session_id = self.site.login(form.get("username"))
+            service = parse_qs(url.query).get("service", [f"http://{self.headers['Host']}/studyrooms/index.php"])[0]
+            self.send(302, headers={"Location": service, "Set-Cookie": f"{SESSION_COOKIE}={session_id}; Path=/"})
+        elif url.path == "/studyrooms/edit_entry_handler.php":
+            if "netlinkid" in form:
+                # Legacy booking form posts credentials with every booking
+                seconds = {"30min": 1800, "1hr": 3600, "90min": 5400, "2hr": 7200}.get(form.get("duration"), 1800)
+                if self.site.book(form["netlinkid"], seconds, date=self.date(form)):
+                    return self.send(200, b"You are not permitted to make bookings that total more than 2 hours in a single day.")
+                return self.send(200, b"<html><body>Booking made</body></html>")
+
+            username = self.username()
+            if username is None:
+                return self.send(200, self.site.pages["edit_entry_login.html"])
+            start = int(form.get("start_seconds", 0))
+            seconds = int(form.get("end_seconds", 0)) - start
+            refused = self.site.book(username, seconds, int(form.get("rooms[]", 0)), start, form.get("name"), form.get("start_date"))
+            if refused == "maxed":
+                return self.send(200, self.site.pages["handler_maxed.html"])
+            if refused == "conflict":
+                return self.send(200, self.site.pages["handler_conflict.html"])
+            self.send(302, headers={"Location": form.get("returl") or "index.php"})
+        else:
+            self.send(404)
+
+
+def serve(port=0, latency=0.0, day_pages=None):
+    """
+    Start the stand-in in a background thread. Returns the server, its StandInSite is
+    'server.site' and its address 'server.url'.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.site = StandInSite(latency, day_pages)
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+    server = serve(port, latency)
+    print(f"Stand-in site running at {server.url}/studyrooms/ (CAS at {server.url}/cas/login)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
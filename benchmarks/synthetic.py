@@ -0,0 +1,158 @@
+'''
+Made up day pages for benchmarks, as big and as busy as asked for.
+
+A SyntheticDay is one day page of one area: which slot of each room is free and which bookings
+(with their rowspans) cover the rest. It can be turned into the Cell list the parsers would
+return for it, or into day_main HTML laid out like the real site's, so the parsers and
+everything after them can be run on the same data at any size.
+
+    days = make_days(days=7, areas=2, rooms=30, occupancy=0.6)
+    cells = [cell for day in days for cell in day.cells()]
+    pages = [(day.html(), day.area, day.day) for day in days]
+
+Everything is drawn from a seeded random.Random, so the same arguments give the same pages.
+'''
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bookV2 import Cell
+from room_catalog import AREA_FLOORS, Room
+
+# Same opening hours and resolution as the saved fixtures
+FIRST_ROW = 28800
+LAST_ROW = 79200
+SLOT_SECONDS = 1800
+# Room ids start above the real ones so the catalog's ratings never apply
+FIRST_ROOM_ID = 1000
+FIRST_BOOKING_ID = 500000
+GROUP_NAMES = ["Book Club", "Thesis Crew", "ECE 360", "Night Owls", "Study Buddies", "CSC 225"]
+
+PAGE = '''<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8"><title>Study Rooms - UVic Libraries</title></head>
+<body class="day">
+<table class="dwm_main" id="day_main" data-resolution="1800">
+<thead>
+<tr>
+<th class="first_last">Time:</th>{header}
+</tr>
+</thead>
+<tbody>
+{rows}
+</tbody>
+</table>
+</body>
+</html>
+'''
+HEADER = '<th data-room="{id}"><a href="index.php?view=week&amp;area={area}&amp;room={id}" title="View Week">{name}</a></th>'
+ROW = '<tr>\n<th data-seconds="{seconds}" class="row_labels"><a href="index.php?view=day&amp;area={area}">{label}</a></th>\n{cells}\n</tr>'
+NEW = ('<td class="new"><div class="celldiv slots1"><a href="edit_entry.php?area={area}&amp;room={room}'
+       '&amp;hour={hour}&amp;minute={minute}&amp;year=2021&amp;month=10&amp;day={day}"></a></div></td>')
+BOOKED = ('<td class="booked"{rowspan}><div class="celldiv slots{rows}"><a href="view_entry.php?id={id}&amp;area={area}'
+          '&amp;day={day}" title="{name}" class="I" data-id="{id}" data-type="I">{name}</a></div></td>')
+
+
+def start_chance(occupancy, max_span):
+    """
+    How likely a booking is to start at a free slot for about 'occupancy' of all slots to end
+    up booked, with bookings 1 to 'max_span' slots long.
+    """
+    mean_span = (1 + max_span) / 2
+    return occupancy / (mean_span - occupancy * mean_span + occupancy)
+
+
+class SyntheticDay():
+    """ One made up day page of one area. """
+
+    def __init__(self, rooms, area, day, first_row=FIRST_ROW, last_row=LAST_ROW):
+        self.rooms = rooms
+        self.area = area
+        self.day = day
+        self.times = list(range(first_row, last_row + 1, SLOT_SECONDS))
+        # Per room, the booking starting at each row as (booking id, group name, rows), None for
+        # a free slot, and False for a slot covered by a booking from an earlier row
+        self.slots = [[None] * len(self.times) for _ in rooms]
+
+    def book(self, column, row, rows, booking_id, group_name):
+        rows = min(rows, len(self.times) - row)
+        self.slots[column][row] = (booking_id, group_name, rows)
+        for covered in range(row + 1, row + rows):
+            self.slots[column][covered] = False
+        return rows
+
+    def occupancy(self):
+        booked = sum(slot is not None for column in self.slots for slot in column)
+        return booked / (len(self.rooms) * len(self.times))
+
+    def cells(self):
+        """ The Cells the parsers return for this page, in the same order. """
+        cells = []
+        for row, time in enumerate(self.times):
+            for column, room in enumerate(self.rooms):
+                slot = self.slots[column][row]
+                if slot is None:
+                    cells.append(Cell(room, None, None, self.area, self.day, time, SLOT_SECONDS))
+                elif slot:
+                    booking_id, group_name, rows = slot
+                    cells.append(Cell(room, group_name, booking_id, self.area, self.day, time, rows * SLOT_SECONDS))
+        return cells
+
+    def html(self):
+        """ The page as the site would serve it. """
+        header = "".join(HEADER.format(id=room.id, area=self.area, name=room.name) for room in self.rooms)
+        rows = []
+        for row, time in enumerate(self.times):
+            hour, minute = time // 3600, time % 3600 // 60
+            cells = []
+            for column, room in enumerate(self.rooms):
+                slot = self.slots[column][row]
+                if slot is None:
+                    cells.append(NEW.format(area=self.area, room=room.id, hour=hour, minute=minute, day=self.day))
+                elif slot:
+                    booking_id, group_name, span = slot
+                    rowspan = f' rowspan="{span}"' if span > 1 else ""
+                    cells.append(BOOKED.format(rowspan=rowspan, rows=span, id=booking_id, area=self.area, day=self.day, name=group_name))
+            rows.append(ROW.format(seconds=time, area=self.area, label=f"{hour:02}:{minute:02}", cells="\n".join(cells)))
+        return PAGE.format(header=header, rows="\n".join(rows))
+
+
+def make_rooms(count, area, rng, first_id=FIRST_ROOM_ID):
+    """ 'count' rooms on the floor of 'area' with random qualities. """
+    return [
+        Room(rng.randint(0, 10), AREA_FLOORS.get(area), f"Room S{first_id + i}", first_id + i)
+        for i in range(count)
+    ]
+
+
+def make_days(days=1, areas=1, rooms=9, occupancy=0.5, max_span=4, seed=0,
+              first_row=FIRST_ROW, last_row=LAST_ROW):
+    """
+    SyntheticDays for 'days' days of 'areas' areas with 'rooms' rooms each. About 'occupancy'
+    of the slots are booked, by bookings of 1 to 'max_span' rows. Rooms are the same every day.
+    """
+    rng = random.Random(seed)
+    chance = start_chance(occupancy, max_span)
+    room_lists = {
+        area: make_rooms(rooms, area, rng, FIRST_ROOM_ID + (area - 1) * rooms)
+        for area in range(1, areas + 1)
+    }
+    booking_id = FIRST_BOOKING_ID
+
+    made = []
+    for offset in range(days):
+        # Day numbers only have to tell the days apart
+        day = offset + 1
+        for area, area_rooms in room_lists.items():
+            synthetic = SyntheticDay(area_rooms, area, day, first_row, last_row)
+            for column in range(len(area_rooms)):
+                row = 0
+                while row < len(synthetic.times):
+                    if rng.random() < chance:
+                        row += synthetic.book(column, row, rng.randint(1, max_span), booking_id, rng.choice(GROUP_NAMES))
+                        booking_id += 1
+                    else:
+                        row += 1
+            made.append(synthetic)
+    return made
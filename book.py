@@ -1,11 +1,11 @@
-import requests
 import json
 import sys
 import lxml.html as lh
 import datetime as dt
 import base64
 import random
-import time
+from availability_cache import AvailabilityCache
+from http_client import HttpClient
 
 #constants
 urlBase = "https://webapp.library.uvic.ca/studyrooms/"
@@ -24,16 +24,22 @@ except:
     sys.exit(0)
 
 booked = [] #Keep track of booked times so the recursive function doesn't double book times
+availability_cache = AvailabilityCache() #Scraped free slots so the recursive calls don't scrape again
+client = HttpClient(1) #Rate limited per host, so no sleeping between scrapes
 
 
 #Scrapes the Uvic url provided and returns an array of dictionaries containing cells that are available for booking(because of the headers row and col indexing starts at 1)
 #Set empty to false to return only rooms booked by you
 def scrape(day,month,year,area,empty):
-    time.sleep(5) 
-    
+    date = dt.date(year, month, day)
+    if empty:
+        cached = availability_cache.get(date, area)
+        if cached is not None:
+            return cached
+
     #lxml is not ideal for parsing HTML and the app should be switched over to beautifulsoup
     
-    page = requests.get(urlBase + "day.php?day={0}&month={1}&year={2}&area={3}".format(day,month,year,area), headers=header)
+    page = client.get(urlBase + "day.php?day={0}&month={1}&year={2}&area={3}".format(day,month,year,area), headers=header)
     doc = lh.fromstring(page.content)
     if area == 2:
         columns = 5
@@ -78,6 +84,8 @@ def scrape(day,month,year,area,empty):
                         totalIterator+=1
                 j+=1
 
+    if empty:
+        return availability_cache.put(date, area, col)
     return col
 
 #Not yet working 
@@ -108,7 +116,7 @@ def book(day,month,year,slot,period,user):
             'room_id':slot['room'],
             'create_by':''} #https://github.com/SavioAlp for the correct post data
 
-    return requests.post(url,values,headers=header)
+    return client.post(url,values,headers=header)
 
 #Merges back to back time slots up to 2h
 def merge(list):
@@ -210,6 +218,9 @@ def scrapeAndBook(delta,startTime,endTime,area,roompref,returnStr=""):
         booked.append(tempStart)
         tempStart += dt.timedelta(minutes=30)
 
+    #Drop the slots we just booked from the cached page instead of scraping it again
+    availability_cache.invalidate_cells(date, area, lambda a: a['room'] == good[0]['room'] and roomDate <= dt.datetime.combine(date, a['time']) < actualEndDate)
+
     if(good[0]['duration'] < ((endDate-startDate).seconds)/60): #Booked duration is shorter than requested
 
         if(good[0]['time'] != startTime): #Booked time is later than the requested start time
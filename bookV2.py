@@ -1,20 +1,26 @@
+# requests, bs4, lxml and pytz are imported where they're used so importing this module
+# (eg. on a Lambda cold start) stays cheap
 import sys
 import json
 import datetime as dt
-import requests
-from bs4 import BeautifulSoup
+from concurrent.futures import as_completed
 import re
 import base64
 import random
-from enum import Enum
-from dataclasses import dataclass
-import pytz
-from math import modf
+import threading
 
-from utils import flatten, get_available, get_within_times, get_our_bookings, get_unbooked, sort_by_prefrence, to_uvic_url
+from availability_cache import AvailabilityCache
+from room_catalog import Floors, Room, Rooms, get_catalog
+import run_trace
+import session_store
+from ranking import get_ranker
+from dispatch import ACCOUNT_DONE, BOOKED, LOGIN_FAILED, MAXED, MAX_CONCURRENT_BOOKINGS, REJECTED, TAKEN, Dispatcher
+from planner import plan, plan_window
+from utils import DayGrid, SlotIndex, flatten, mask_runs, slot_mask, get_available, get_within_times, get_our_bookings, get_unbooked, sort_by_prefrence, to_uvic_url
 
 loginUrl = "https://www.uvic.ca/cas/login"
 urlBase = "https://webapp.library.uvic.ca/studyrooms/"
+
 header = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; rv:91.0) Gecko/20100101 Firefox/91.0",
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -24,60 +30,17 @@ header = {
     'Connection': 'keep-alive',
     'Content-Type': 'application/x-www-form-urlencoded'
 }
+# Max number of day pages fetched at the same time
+MAX_CONCURRENT_SCRAPES = 4
 
-class Floors(Enum):
-    BASEMENT = 0
-    FIRST = 1
-    SECOND = 2
-
-@dataclass
-class Room:
-    """
-    Represents a bookable room. Quality ranges from 0 to 10. Quality does not have to be unique
-    """
-    quality: int
-    floor: Floors
-    name: str
-    id: int
-
-@dataclass
-class Rooms(Enum):
-    
-    ROOM113A = Room(quality=5, floor=Floors.FIRST, name='Room 113a', id=1)
-    ROOM113B = Room(quality=4, floor=Floors.FIRST, name='Room 113b', id=2)
-    ROOM113C = Room(quality=3, floor=Floors.FIRST, name='Room 113c', id=3)
-    ROOM113D = Room(quality=8, floor=Floors.FIRST, name='Room 113d', id=4)
-    ROOM131 = Room(quality=8, floor=Floors.FIRST, name='Room 131', id=5)
-    ROOMA103 = Room(quality=6, floor=Floors.FIRST, name='Room A103', id=6)
-    ROOMA105 = Room(quality=7, floor=Floors.FIRST, name='Room A105', id=7)
-    ROOMA107 = Room(quality=9, floor=Floors.FIRST, name='Room A107', id=8)
-    ROOMA109 = Room(quality=10, floor=Floors.FIRST, name='Room A109', id=9)
-    ROOM050A = Room(quality=1, floor=Floors.BASEMENT, name='Room 050A', id=10)
-    ROOM050B = Room(quality=1, floor=Floors.BASEMENT, name='Room 050B', id=11)
-    ROOM050C = Room(quality=1, floor=Floors.BASEMENT, name='Room 050C', id=12)
-    ROOM223 = Room(quality=2, floor=Floors.SECOND, name='Room 223', id=13)
-    ROOM270 = Room(quality=2, floor=Floors.SECOND, name='Room 270', id=14)
-    ROOM272 = Room(quality=2, floor=Floors.SECOND, name='Room 272', id=15)
-    ROOM274 = Room(quality=2, floor=Floors.SECOND, name='Room 274', id=16)
-
-room_map = {
-    1: Rooms.ROOM113A,
-    2: Rooms.ROOM113B,
-    3: Rooms.ROOM113C,
-    4: Rooms.ROOM113D,
-    5: Rooms.ROOM131,
-    6: Rooms.ROOMA103,
-    7: Rooms.ROOMA105,
-    8: Rooms.ROOMA107,
-    9: Rooms.ROOMA109,
-    10: Rooms.ROOM050A,
-    11: Rooms.ROOM050B,
-    12: Rooms.ROOM050C,
-    13: Rooms.ROOM223,
-    14: Rooms.ROOM270,
-    15: Rooms.ROOM272,
-    16: Rooms.ROOM274
-}
+DAY_MAIN_RE = re.compile(r'<table[^>]*\bid=["\']day_main["\']')
+ROOM_ID_RE = re.compile(r'(?<=room\=)\d+')
+
+def set_site(url_base, login_url):
+    """ Point every request at another copy of the site, eg. the benchmark stand-in server. """
+    global urlBase, loginUrl
+    urlBase = url_base
+    loginUrl = login_url
 
 class Credentials():
     login = None
@@ -107,8 +70,189 @@ class Credentials():
 
         return login, possible_names
 
+_credentials = None
+
+
+def get_credentials():
+    """ Credentials from login.json and group_names.json, loaded once and then reused. """
+    global _credentials
+    if _credentials is None:
+        _credentials = Credentials('login.json', 'group_names.json')
+    return _credentials
+
+
+def decode_password(user):
+    """ Decode a base64 encoded password from login.json. """
+    password = str(base64.standard_b64decode(user['password']))
+    # Remove extra base64 decode characters
+    return password[2:-1]
+
+
+class AuthSession():
+    """ A logged in requests session for one account, along with its CSRF token. """
+
+    def __init__(self, user):
+        self.user = user
+        # Room for a hedged second submission alongside the first
+        self.session = make_session(2)
+        self.csrf_token = None
+
+    def login(self, date, area):
+        """
+        Run the CAS login dance and fetch a CSRF token. Returns False if the login was rejected.
+        """
+        s = self.session
+        with run_trace.phase("login", user=self.user['username']):
+            # Get the execution token from login page
+            resp = s.get(
+                loginUrl+f"?service={urlBase}edit_entry.php", headers=header)
+            # Parse it with BeautifulSoup
+            from bs4 import BeautifulSoup
+            soup = BeautifulSoup(resp.text, "lxml")
+            execution_token = soup.find(
+                attrs={"name": "execution"}).attrs['value']
+
+            # Log in. Not retried, the execution token is only good for one attempt
+            login_params = {
+                "username": self.user['username'],
+                "password": decode_password(self.user),
+                "execution": execution_token,
+                "rememberMe": True,
+                "_eventId": "submit"
+            }
+            s.post(loginUrl+f"?service={urlBase}edit_entry.php?year={date.year}&month={date.month}&day={date.day}&area={area}", login_params, headers=header, verify=False)
+        return self.refresh_csrf(date, area)
+
+    def refresh_csrf(self, date, area):
+        """ Fetch a fresh CSRF token. Returns False if the session is not logged in. """
+        with run_trace.phase("csrf", user=self.user['username']):
+            #See if login was successful
+            resp = self.session.get(f"{urlBase}edit_entry.php?year={date.year}&month={date.month}&day={date.day}&area={area}", headers=header, verify=False)
+
+            if "Please login to create" in resp.text:
+                self.csrf_token = None
+                return False
+
+            #Parse it with BeautifulSoup
+            from bs4 import BeautifulSoup
+            soup = BeautifulSoup(resp.text, "lxml")
+            # Get CSRF token
+            self.csrf_token = soup.find(
+                attrs={"name": "csrf_token"}).attrs['content']
+            return True
+
+    def submit(self, params):
+        """
+        Post a booking request with this session's CSRF token. A slow submission is hedged with
+        a second copy, the site only lets one of them book the room.
+        """
+        params = dict(params, csrf_token=self.csrf_token)
+        with run_trace.phase("submit", user=self.user['username'], room=params.get("rooms[]"), start=params.get("start_seconds")):
+            return self.session.hedged_post(
+                urlBase+"edit_entry_handler.php", params, accept=lambda resp: resp.is_redirect,
+                headers=header, verify=False, allow_redirects=False
+            )
+
+    def state(self):
+        """ Cookies and CSRF token, for a session store. """
+        return session_store.session_state(self.session.cookies, self.csrf_token)
+
+    def resume(self, state, date, area):
+        """
+        Pick up a stored session instead of logging in. Returns False if it has expired, which
+        costs a single page load to find out rather than the whole CAS login.
+        """
+        if not session_store.is_fresh(state):
+            return False
+        session_store.restore_cookies(self.session.cookies, state)
+        return self.refresh_csrf(date, area)
+
+    def close(self):
+        self.session.close()
+
+
+class SessionPool():
+    """
+    Keeps one logged in AuthSession per username so an account only logs in once.
+    Sessions are created lazily on first use and again after being invalidated.
+
+    With a 'store' (see session_store.py) logins also outlive the process: stored sessions are
+    resumed before falling back to logging in, and every fresh login is stored.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self._sessions = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _stored(self, method, *args):
+        # A broken store costs us the shortcut, never the booking
+        if self.store is None:
+            return None
+        try:
+            return getattr(self.store, method)(*args)
+        except Exception as e:
+            print(f"Session store {method} failed: {type(e).__name__}: {e}")
+            return None
+
+    def _user_lock(self, username):
+        # One lock per account so different accounts can log in at the same time
+        with self._lock:
+            return self._locks.setdefault(username, threading.Lock())
+
+    def get(self, user, date, area):
+        """ Return a logged in AuthSession for 'user', or None if the login failed. """
+        username = user['username']
+        with self._user_lock(username):
+            auth = self._sessions.get(username)
+            if auth is not None:
+                return auth
+
+            auth = AuthSession(user)
+            resumed = False
+            state = self._stored("load", username)
+            if state is not None:
+                with run_trace.phase("resume", user=username):
+                    resumed = auth.resume(state, date, area)
+                if not resumed:
+                    # Expired, start over with a clean cookie jar
+                    auth.close()
+                    auth = AuthSession(user)
+            if not resumed and not auth.login(date, area):
+                auth.close()
+                self._stored("delete", username)
+                return None
+            # Resuming can renew cookies too, keep the latest
+            self._stored("save", username, auth.state())
+            self._sessions[username] = auth
+            return auth
+
+    def invalidate(self, user):
+        """ Drop the pooled (and stored) session for 'user', eg. after it has been signed out. """
+        with self._lock:
+            auth = self._sessions.pop(user['username'], None)
+        self._stored("delete", user['username'])
+        if auth is not None:
+            auth.close()
+
+    def clear(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for auth in sessions.values():
+            auth.close()
+
+
+# Shared between runs so warm processes keep their logins, and stored so cold ones can too
+session_pool = SessionPool(session_store.default_store())
+# Scraped pages, so retries and later time slots in the same run don't refetch them
+availability_cache = AvailabilityCache()
+
+
 class Cell(object):
     """ Holds booking parameters for a cell in the bookings table. """
+    # Days can hold thousands of cells, keep them small
+    __slots__ = ("room_meta", "group_name", "booking_id", "area", "day", "time", "duration")
 
     def __init__(self, room, group_name, booking_id,
                  area, day, time, duration):
@@ -123,7 +267,8 @@ class Cell(object):
         self.duration = duration
 
     def is_booked(self):
-        return (self.booking_id is not None)
+        # A booking we just made has no id until the page is read again
+        return (self.booking_id is not None or self.group_name is not None)
 
     def is_between_times(self, start=0, end=0):
         """
@@ -136,7 +281,7 @@ class Cell(object):
 
     # TODO: Make these nicer with hours and proper times
     def __repr__(self):
-        if self.booking_id is not None:
+        if self.is_booked():
             return (f"{self.group_name} has "
                     f"{self.room_meta.name} at "
                     f"{self.time} for "
@@ -148,16 +293,92 @@ class Cell(object):
             return f"{self.room_meta.name} is unbooked at {hour}:{minute} for {self.duration / 3600} hours." 
 
 
-def scrape(day, month, year, area):
-    # TODO Find a way to get room names
-    """ Scrape the given date and area and return an array of Cell objects. """
-    # IMPORTANT, DO NOT TOUCH
-    # time.sleep(5)
+def make_session(pool_size=MAX_CONCURRENT_SCRAPES):
+    """
+    Create an HttpClient (rate limited, with timeouts and retries) whose connection pool can
+    keep 'pool_size' connections alive at once.
+    """
+    from http_client import HttpClient
+    return HttpClient(pool_size)
+
 
+def fetch_grid(date, area, session=None, parser=None):
+    """ Fetch and parse the page for 'date' and 'area' into a DayGrid, skipping the cache. """
+    # No sleeping between scrapes, the client's per-host rate limit keeps us polite
     # Scrape the webpage for its data
-    resp = requests.get(to_uvic_url(day, month, year, area), headers=header, verify=False) # TODO: Fix ssl error
+    if session is None:
+        session = make_session(1)
+    with run_trace.phase("fetch", area=area, date=str(date)):
+        resp = session.get(to_uvic_url(date.day, date.month, date.year, area, urlBase), headers=header, verify=False) # TODO: Fix ssl error
+    with run_trace.phase("parse", area=area, date=str(date)):
+        return DayGrid.from_cells(parse_day(resp.text, area, date.day, parser), area, date.day, Cell)
+
+
+def scrape(day, month, year, area, session=None, parser=None, fresh=False):
+    # TODO Find a way to get room names
+    """
+    Scrape the given date and area and return its DayGrid. The grid is shared with the
+    cache, read only, don't modify it.
+
+    Pages are served from availability_cache while they're fresh, pass fresh=True to
+    always hit the site.
+    """
+    date = dt.date(year, month, day)
+    if not fresh:
+        grid = availability_cache.get(date, area)
+        if grid is not None:
+            return grid
+    return availability_cache.put(date, area, fetch_grid(date, area, session, parser))
+
+
+def day_grid(date, area, session=None):
+    """
+    The DayGrid for 'date' and 'area', shared through availability_cache so repeated and
+    overlapping queries only scrape each page once. Read only, don't modify it.
+    """
+    return availability_cache.get_or_load(date, area, lambda: fetch_grid(date, area, session))
+
+
+def claim_cached(date, cell, group_name):
+    """ Mark a freshly booked 'cell' as booked by 'group_name' in the cached page. """
+    availability_cache.update(date, cell.area, lambda grid: grid.with_booking(cell, group_name))
+
+
+def scrape_many(targets, max_workers=MAX_CONCURRENT_SCRAPES, session=None, fresh=False):
+    """
+    Scrape several (day, month, year, area) pages in parallel over one pooled session.
+
+    At most 'max_workers' requests are in flight at once and every page is parsed as soon
+    as it arrives. Returns the DayGrid of each target, in the order of 'targets'.
+    """
+    targets = list(targets)
+    if session is None:
+        session = make_session(max(1, min(max_workers, len(targets))))
+
+    results = [None] * len(targets)
+    with run_trace.ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {pool.submit(scrape, *target, session=session, fresh=fresh): i for i, target in enumerate(targets)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    return results
+
+
+def parse_day(html, area, day, parser=None):
+    """
+    Parse a day view page and return an array of Cell objects.
+
+    'parser' picks the backend from PARSERS, defaulting to DEFAULT_PARSER. Every backend
+    returns the same cells, the BeautifulSoup one is slower but kept around to check against.
+    """
+    return PARSERS[parser or DEFAULT_PARSER](html, area, day)
+
+
+def parse_day_bs4(html, area, day):
+    """ Parse a day view page by building a full BeautifulSoup tree of it. """
     # Parse it with BeautifulSoup
-    soup = BeautifulSoup(resp.text, "lxml")
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, "lxml")
 
     # Get a list of all tables and pick out the one we need
     bookings_table = soup.find("table", {'id': 'day_main'})
@@ -166,16 +387,18 @@ def scrape(day, month, year, area):
     # Get the room ids from the header
     booking_table_header = bookings_table_rows[0].find_all("th")
     room_ids = [int(x['data-room']) for x in booking_table_header[1:]]
+    catalog = get_catalog()
+    catalog.learn(area, [(int(x['data-room']), x.text.strip()) for x in booking_table_header[1:]])
 
     existing_bookings = []
+    spans = [0] * len(room_ids)
     for tr in bookings_table_rows[1:]:
         # Gets the time of the row. Format is seconds since midnight
         row_time = int(tr.find("th")[
                        "data-seconds"])
 
-
-        row_cols = tr.find_all("td")
-        for raw_cell, room_id in zip(row_cols, room_ids):
+        column = 0
+        for raw_cell in tr.find_all("td"):
             """
             In each <td> tag:
             - td_class tells you if the room is booked or unbooked.
@@ -183,30 +406,28 @@ def scrape(day, month, year, area):
             - link in the <a> tag contains the date.
             - div_class tells you the duration and booking id.
             """
-            duration = 1800 # Default booking is 30 minutes
-            if 'rowspan' in raw_cell.attrs:
-                duration = int(raw_cell.attrs["rowspan"]) * 1800
+            column = next_column(spans, column)
+            rows = int(raw_cell.attrs.get("rowspan", 1))
+            duration = rows * 1800 # Default booking is 30 minutes
+            spans[column] = rows
 
             # Room unbooked
             if "new" in raw_cell.attrs["class"]:
-                # Room id can be affected by rowspan so update it here
-                room_id = int(re.search(r'(?<=room\=)\d+', raw_cell.find('a').attrs['href']).group())
+                # The link has the room id, check it against the column
+                room_id = int(ROOM_ID_RE.search(raw_cell.find('a').attrs['href']).group())
                 group_name = None
                 booking_id = None
-                
-            
-            # TODO: Booked rooms can take the wrong room ID with the current method. Find something better.
-            # This is not needed for room booking but would be nice for additional functionality
+
             elif "booked" in raw_cell.attrs["class"]:
-                continue
-                group_name = raw_cell.text.strip()
-                raw_cell_div = raw_cell.find("div")
-                booking_id = int(raw_cell_div.find('a').attrs["data-id"])
+                room_id = room_ids[column]
+                link = raw_cell.find("div").find('a')
+                group_name = link.text.strip()
+                booking_id = int(link.attrs["data-id"])
 
             else:
                 raise ValueError("Unexpected cell")
 
-            room = room_map[room_id].value
+            room = catalog.room(room_id, area=area)
             
             existing_bookings.append(
                 Cell(
@@ -219,151 +440,437 @@ def scrape(day, month, year, area):
                     duration
                 )
             )
+            column += 1
+        spans = [max(0, rows - 1) for rows in spans]
 
     return existing_bookings
 
 
+def next_column(spans, column):
+    """
+    The first column from 'column' on that isn't still covered by a cell with a rowspan
+    from an earlier row. 'spans' holds how many rows each column is taken for.
+    """
+    while column < len(spans) and spans[column]:
+        column += 1
+    if column == len(spans):
+        raise ValueError("More cells in row than rooms")
+    return column
 
 
+def day_main_html(html):
+    """ Cut the day_main table out of a day view page. """
+    table_start = DAY_MAIN_RE.search(html)
+    if table_start is None:
+        raise ValueError("No day_main table in page")
+    table_end = html.find("</table>", table_start.start())
+    return html[table_start.start():table_end + len("</table>")]
 
-def get_requested_times(offset, start_time, end_time):
+
+def parse_day_lxml(html, area, day):
+    """
+    Parse a day view page by cutting out just the day_main table and walking it with lxml.
+    Nothing outside the table gets parsed.
+
+    Cells with a rowspan push the cells of the following rows to the right, so which rows each
+    column is still taken for is tracked to put every cell (free or booked) in its room.
+    """
+    import lxml.html
+    table = lxml.html.fragment_fromstring(day_main_html(html))
+
+    rows = table.iter("tr")
+    # Get the room ids (and names, for rooms we haven't seen) from the header
+    headers = [(int(th.get('data-room')), th.text_content().strip()) for th in next(rows).findall("th")[1:]]
+    room_ids = [room_id for room_id, _ in headers]
+    catalog = get_catalog()
+    catalog.learn(area, headers)
+
+    existing_bookings = []
+    spans = [0] * len(room_ids)
+    for tr in rows:
+        # Gets the time of the row. Format is seconds since midnight
+        row_time = int(tr.find("th").get("data-seconds"))
+
+        column = 0
+        for raw_cell in tr.iterchildren("td"):
+            column = next_column(spans, column)
+            classes = raw_cell.get("class", "").split()
+            span = int(raw_cell.get("rowspan", 1))
+            spans[column] = span
+
+            if "new" in classes:
+                room_id = int(ROOM_ID_RE.search(raw_cell.find(".//a").get("href")).group())
+                group_name = booking_id = None
+            elif "booked" in classes:
+                room_id = room_ids[column]
+                link = raw_cell.find(".//a")
+                group_name = link.text_content().strip()
+                booking_id = int(link.get("data-id"))
+            else:
+                raise ValueError("Unexpected cell")
+
+            existing_bookings.append(
+                Cell(catalog.room(room_id, area=area), group_name, booking_id, area, day, row_time, span * 1800)
+            )
+            column += 1
+        spans = [max(0, span - 1) for span in spans]
+
+    return existing_bookings
+
+
+PARSERS = {
+    "bs4": parse_day_bs4,
+    "lxml": parse_day_lxml,
+}
+DEFAULT_PARSER = "lxml"
+
+
+def get_index(offset, areas=(1, 3), max_workers=MAX_CONCURRENT_SCRAPES):
+    """
+    Scrape every area 'offset' days in the future and return a SlotIndex of the free rooms.
+
+    Every area is fetched in parallel, with at most 'max_workers' requests in flight.
+    """
+    # Get however many days in the future
+    date = booking_date(offset)
+
+    # Every floor except the basement (yuck) by default
+    areas = useful_areas(areas)
+    grids = scrape_many([(date.day, date.month, date.year, area) for area in areas], max_workers=max_workers)
+    with run_trace.phase("index", date=str(date)):
+        return build_index(grids)
+
+
+def useful_areas(areas):
+    """ Leave out areas where the room catalog says there's no room we'd accept. """
+    useful = get_catalog().useful_areas(areas, get_ranker().acceptable)
+    if len(useful) < len(areas):
+        print(f"Skipping areas {sorted(set(areas) - set(useful))}, no rooms worth booking")
+    return useful
+
+
+def build_index(grids):
+    """ SlotIndex of the free slots in DayGrids 'grids', leaving out rooms excluded in the ranking config. """
+    index = SlotIndex.from_grids(grids)
+    ranker = get_ranker()
+    for room_id, cell in list(index.templates.items()):
+        if not ranker.acceptable(cell.room_meta):
+            index.discard(room_id)
+    return index
+
+
+def get_requested_times(offset, start_time, end_time, areas=(1, 3), max_workers=MAX_CONCURRENT_SCRAPES):
     """
     Return all free rooms during requested time period,
     'offset' days in the future.
-    """
-    # Get however many days in the future. UVIC is in PST so force this timezone
-    date = dt.datetime.now(pytz.timezone('US/Pacific')).date() + dt.timedelta(days=offset)
-    year = date.year
-    month = date.month
-    day = date.day
-
-    rooms = []
-    # Iterate through every floor except the basement (yuck)
-    for i in [1, 3]:
-        rooms += scrape(day, month, year, i)
-
-    # Filter any room not in the time we want
-    unbooked_rooms = get_unbooked(rooms)
-    rooms_on_time = get_within_times(unbooked_rooms, start_time, end_time)
-
-
-    # Drop overlapping times
-    times = []
-    i = 0
-    while i < len(rooms_on_time):
-        if rooms_on_time[i].time not in times:
-            times.append(rooms_on_time[i].time)
-            i += 1
-        else:
-            del(rooms_on_time[i])
-
-    # Merge adjacent cells, assumes all cells have a 30min duration
-    good_rooms = sorted(rooms_on_time, key=lambda x: (x.room_meta.id, x.time))
-    i = len(good_rooms) - 1
-    while i >= 1:
-        prev_h = int(good_rooms[i-1].time / 3600)
-        prev_m = int(modf((good_rooms[i-1].time / 3600))[0] * 60)
-        cur_h = int(good_rooms[i].time / 3600)
-        cur_m = int(modf((good_rooms[i].time / 3600))[0] * 60)
-
-        if good_rooms[i-1].room_meta.id == good_rooms[i].room_meta.id:
-            if (prev_h == cur_h or (abs(prev_h - cur_h) == 1 and prev_m == 30 and cur_m == 0) and good_rooms[i-1].duration < 7200):
-                good_rooms[i-1].duration += good_rooms[i].duration
-                del(good_rooms[i])
-                i -= 1
-                continue
 
-        i -= 1
+    Every area is fetched in parallel, with at most 'max_workers' requests in flight.
+    """
+    # Pick the fewest, best rooms that cover the time we want, in bookings of up to 2 hours
+    index = get_index(offset, areas, max_workers)
+    with run_trace.phase("plan"):
+        good_rooms = plan_window(index, start_time, end_time, score=get_ranker().score)
 
-    good_rooms_sorted = sort_by_prefrence(good_rooms)
+    good_rooms_sorted = sort_by_prefrence(good_rooms, get_ranker().score)
 
     return good_rooms_sorted
 
 
-def make_booking(cells, offset):
+def availability(offset, start_time, end_time, areas=(1, 3), max_workers=MAX_CONCURRENT_SCRAPES):
+    """
+    Free time of every room between 'start_time' and 'end_time', 'offset' days in the future,
+    as (room, [(start, end), ...]) best room first. Nothing is booked and pages scraped in
+    the last few seconds are reused.
+    """
+    date = booking_date(offset)
+    areas = useful_areas(areas)
+    session = make_session(max(1, min(max_workers, len(areas))))
+    with run_trace.ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        grids = list(pool.map(lambda area: day_grid(date, area, session), areas))
+
+    ranker = get_ranker()
+    window = slot_mask(start_time, end_time)
+    free = []
+    for grid in grids:
+        for room in grid.rooms:
+            runs = mask_runs(grid.free_mask(room.id) & window)
+            if runs and ranker.acceptable(room):
+                free.append((room, runs))
+    free.sort(key=lambda x: ranker.score(x[0]), reverse=True)
+    return free
+
+
+def our_bookings(offset, areas=(1, 3), max_workers=MAX_CONCURRENT_SCRAPES):
+    """
+    Every booking 'offset' days in the future made under one of our group names. Read off
+    the same cached day grids used for booking, so right after a run this fetches nothing.
+    """
+    date = booking_date(offset)
+    names = get_credentials().group_names
+    session = make_session(max(1, min(max_workers, len(areas))))
+    with run_trace.ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        grids = list(pool.map(lambda area: day_grid(date, area, session), areas))
+    return [cell for grid in grids for cell in get_our_bookings(grid, names)]
+
+
+def booking_date(offset):
+    """ The date 'offset' days in the future. UVIC is in PST so force this timezone """
+    import pytz
+    return dt.datetime.now(pytz.timezone('US/Pacific')).date() + dt.timedelta(days=offset)
+
+
+def booking_params(cell, date, user, group_names):
+    """ Build the edit_entry_handler.php POST body (minus the CSRF token) for booking 'cell'. """
+    # Uvic now uses seconds as the booking time. Go figure...
+    start_seconds = cell.time
+    end_seconds = start_seconds + cell.duration
+    return {
+        'returl': f"{urlBase}index.php?year={date.year}&month={date.month}&day={date.day}&area={cell.area}",
+        'create_by': user['username'],
+        "rep_id": 0,
+        "edit_type": "series",
+        "name": random.choice(group_names),
+        "rooms[]": cell.room_meta.id,
+        "start_date": date.strftime("%Y-%m-%d"),
+        "start_seconds": start_seconds,
+        "end_seconds": end_seconds
+    }
+
+
+# Submission outcome that only means we need to log in again
+SIGNED_OUT = "signed out"
+
+
+def submit_outcome(resp):
+    """
+    What a response from edit_entry_handler.php says happened, without asking the site again.
+    A booking that went through redirects back to the day view, anything else is a page
+    explaining what went wrong.
+    """
+    if resp.is_redirect:
+        # An expired session gets bounced to a login page instead
+        if "login" in resp.headers.get("Location", "").lower():
+            return SIGNED_OUT
+        return BOOKED
+    if "Please login" in resp.text:
+        return SIGNED_OUT
+    # Account maxed
+    if "The maximum number of bookings" in resp.text:
+        return MAXED
+    if "conflict with the following entries" in resp.text:
+        return TAKEN
+    return REJECTED
+
+
+def try_booking(cell, user, date, group_names, pool):
+    """
+    Try to book 'cell' on 'date' with one account. Returns BOOKED if the site accepted the
+    booking, otherwise LOGIN_FAILED, MAXED, TAKEN or REJECTED.
+    """
+    auth = pool.get(user, date, cell.area)
+    if auth is None:
+        print(f"Login for user {user} failed")
+        return LOGIN_FAILED
+
+    params = booking_params(cell, date, user, group_names)
+
+    # Make the final booking request
+    outcome = submit_outcome(auth.submit(params))
+
+    if outcome == SIGNED_OUT:
+        # Session expired since it was pooled, log in again and retry once
+        pool.invalidate(user)
+        auth = pool.get(user, date, cell.area)
+        if auth is None:
+            print(f"Login for user {user} failed")
+            return LOGIN_FAILED
+        outcome = submit_outcome(auth.submit(params))
+
+        if outcome == SIGNED_OUT:
+            raise ConnectionError("Signed out, something is probably wrong with the booking request")
+
+    if outcome == BOOKED:
+        claim_cached(date, cell, params["name"])
+        print(cell)
+    return outcome
+
+
+def verify_bookings(date, results, session=None, names=None):
+    """
+    Check the bookings in 'results' (anything with a .cell, eg. Attempts) really are on the
+    site by fetching each day page they're on once, however many bookings it has. Sets
+    .confirmed and .booking_id on each and returns how many were confirmed.
+
+    The fresh pages replace the cached ones, so later queries see what was booked.
+    """
+    results = list(results)
+    if not results:
+        return 0
+    grids = refetch_grids(date, {result.cell.area for result in results}, session)
+    return confirm_bookings(date, results, grids, names)
+
+
+def refetch_grids(date, areas, session=None):
+    """ Fetch a fresh DayGrid of each area on 'date' at once, and cache them. """
+    areas = sorted(areas)
+    session = session or make_session(len(areas))
+    with run_trace.phase("verify", date=str(date), areas=len(areas)):
+        with run_trace.ThreadPoolExecutor(max_workers=len(areas)) as pool:
+            grids = dict(zip(areas, pool.map(lambda area: fetch_grid(date, area, session), areas)))
+    for area, grid in grids.items():
+        availability_cache.put(date, area, grid)
+    return grids
+
+
+def confirm_bookings(date, results, grids, names=None):
+    """ The checking half of verify_bookings, against already fetched 'grids' keyed by area. """
+    names = set(names or get_credentials().group_names)
+    confirmed = 0
+    for result in results:
+        cell = result.cell
+        # Every slot of the booking has to be taken by one of our groups
+        found = [grids[cell.area].cell_at(cell.room_meta.id, time) for time in range(cell.time, cell.time + cell.duration, 1800)]
+        result.confirmed = all(c is not None and c.is_booked() and c.group_name in names for c in found)
+        if result.confirmed:
+            result.booking_id = found[0].booking_id
+            confirmed += 1
+    print(f"Confirmed {confirmed} of {len(results)} bookings on {date}")
+    return confirmed
+
+
+def make_booking(cells, offset, pool=None):
     """
     Tries to make a booking for each cell, 'offset' days in the future.
+
+    Accounts are logged in through 'pool' (the module wide session pool by default)
+    so each account only logs in once per run. Returns the cells that were booked.
     """
     if len(cells) == 0:
         return "No rooms found"
-        
+    if pool is None:
+        pool = session_pool
+
     # Get however many days in the future
-    date =  dt.datetime.now(pytz.timezone('US/Pacific')).date() + dt.timedelta(days=offset)
+    date = booking_date(offset)
     date_str = date.strftime("%Y-%m-%d")
 
     print(f"Booking for {date_str}")
 
-    creds = Credentials('login.json', 'group_names.json')
+    creds = get_credentials()
     users = creds.login['users']
+    booked = []
+    # Accounts that are maxed out or can't log in aren't tried again
+    done = set()
     for cell in cells:
         for user in users:
-            # Create a new session
-            with requests.Session() as s:
-
-                # Get the execution token from login page
-                resp = s.get(
-                    loginUrl+f"?service=https://webapp.library.uvic.ca/studyrooms/edit_entry.php", headers=header)
-                # Parse it with BeautifulSoup
-                soup = BeautifulSoup(resp.text, "lxml")
-                execution_token = soup.find(
-                    attrs={"name": "execution"}).attrs['value']
-
-                # Log in
-                password = str(base64.standard_b64decode(user['password']))
-                # Remove extra base64 decode characters
-                password = password[2:-1]
-                login_params = {
-                    "username": user['username'],
-                    "password": password,
-                    "execution": execution_token,
-                    "rememberMe": True,
-                    "_eventId": "submit"
-                }
-                lg = s.post(loginUrl+f"?service=https://webapp.library.uvic.ca/studyrooms/edit_entry.php?year={date.year}&month={date.month}&day={date.day}&area={cell.area}&room={cell.room_meta.id}", login_params, headers=header, verify=False)
-                #s.post(loginUrl+"?service=https://webapp.library.uvic.ca/studyrooms/edit_entry_handler.php", params, headers=header, verify=False)
-                #See if login was successful
-                resp = s.get(f"https://webapp.library.uvic.ca/studyrooms/edit_entry.php?year={date.year}&month={date.month}&day={date.day}&area={cell.area}", headers=header, verify=False)
-    
-                if "Please login to create" in resp.text:
-                   print(f"Login for user {user} failed")
-                   continue  # Login failed, move to next account
-
-                #Parse it with BeautifulSoup
-                soup = BeautifulSoup(resp.text, "lxml")
-                # Get CSRF token
-                csrf_token = soup.find(
-                    attrs={"name": "csrf_token"}).attrs['content']
-
-                # Uvic now uses seconds as the booking time. Go figure...
-                start_seconds = cell.time
-                end_seconds = start_seconds + cell.duration
-                params = {
-                    "csrf_token": csrf_token,
-                    'returl': f"https://webapp.library.uvic.ca/studyrooms/index.php?year={date.year}&month={date.month}&day={date.day}&area={cell.area}",
-                    'create_by': user['username'],
-                    "rep_id": 0,
-                    "edit_type": "series",
-                    "name": random.choice(creds.group_names),
-                    "rooms[]": cell.room_meta.id,
-                    "start_date": date_str,
-                    "start_seconds": start_seconds,
-                    "end_seconds": end_seconds
-                }
-
-                # Make the final booking request
-                resp = s.post(urlBase+"edit_entry_handler.php", params, headers=header, verify=False, allow_redirects=False)
-
-                if "Please login" in resp.text:
-                    raise ConnectionError("Signed out, something is probably wrong with the booking request")
-
-                # Account maxed, move onto next
-                if "The maximum number of bookings" in resp.text:
-                    continue
-
+            if user['username'] in done:
+                continue
+            outcome = try_booking(cell, user, date, creds.group_names, pool)
+            if outcome == BOOKED:
                 # Sucessful booking, break out of user loop
-                print(cell)
+                booked.append(cell)
                 break
+            if outcome in ACCOUNT_DONE:
+                done.add(user['username'])
+            else:
+                # The room itself can't be had, no point trying it with other accounts
+                break
+    return booked
+
 
+def book_plan(assignments, offset, index=None, pool=None, max_workers=MAX_CONCURRENT_BOOKINGS, verify=True, creds=None, claims=None):
+    """
+    Submit planned bookings 'offset' days in the future, each with the account it was assigned.
+    Different accounts book at the same time. When a room can't be booked, other rooms free
+    at the same time in 'index' are tried, and cells left by maxed out accounts go to the others.
+
+    With 'verify', once everything is submitted each day page booked on is fetched once more to
+    confirm the bookings landed. 'creds' are the accounts to use (login.json by default) and
+    'claims' a SlotClaims to share with other runs going at the same time. Returns the list
+    of Attempts.
+    """
+    if len(assignments) == 0:
+        return "No rooms found"
+    if pool is None:
+        pool = session_pool
+
+    date = booking_date(offset)
+    print(f"Booking for {date.strftime('%Y-%m-%d')}")
+
+    creds = creds or get_credentials()
+    ranker = get_ranker()
+
+    def alternatives(cell):
+        if index is None:
+            return []
+        rooms = [r for r in index.rooms_free_between(cell.time, cell.time + cell.duration) if r != cell.room_meta.id]
+        rooms.sort(key=lambda r: ranker.score(index.templates[r].room_meta), reverse=True)
+        return [index.cell(r, cell.time, cell.duration) for r in rooms]
+
+    dispatcher = Dispatcher(
+        lambda cell, user: try_booking(cell, user, date, creds.group_names, pool),
+        alternatives,
+        max_workers,
+        claims
+    )
+    attempts = dispatcher.run(assignments, creds.login['users'])
+    if verify:
+        verify_bookings(date, [attempt for attempt in attempts if attempt.outcome == BOOKED], names=creds.group_names)
+    for attempt in attempts:
+        print(attempt)
+    # Feeds the success rates the next run's ranking starts from
+    ranker.history.record(attempts)
+    return attempts
+
+
+@run_trace.traced
+def book_windows(days_in_future, windows, areas=(1, 3)):
+    """
+    Plan and book every (start, end) window 'days_in_future' days out in one go, so the
+    accounts' daily limits are shared sensibly between the windows.
+    """
+    creds = get_credentials()
+    index = get_index(days_in_future, areas)
+    with run_trace.phase("plan", offset=days_in_future):
+        assignments = plan(index, windows, creds.login['users'], score=get_ranker().score)
+    return book_plan(assignments, days_in_future, index)
+
+
+@run_trace.traced
+def book_days(requests_by_offset, areas=(1, 3), max_workers=MAX_CONCURRENT_SCRAPES):
+    """
+    Book several days in one run. 'requests_by_offset' maps days in the future to the
+    (start, end) windows wanted that day.
+
+    Every page for every day is requested up front over one pooled session. Each day is
+    planned and booked as soon as its own pages are in while the later days are still
+    loading, and logins are shared between all of them. Returns the Attempts for each offset.
+    """
+    offsets = sorted(o for o, windows in requests_by_offset.items() if windows)
+    if not offsets:
+        return {}
+    areas = useful_areas(areas)
+
+    creds = get_credentials()
+    session = make_session(max_workers)
+    results = {}
+    with run_trace.ThreadPoolExecutor(max_workers=max_workers) as scrapers:
+        pages = {}
+        for offset in offsets:
+            date = booking_date(offset)
+            pages[offset] = [scrapers.submit(scrape, date.day, date.month, date.year, area, session=session) for area in areas]
+
+        for offset in offsets:
+            grids = [page.result() for page in pages[offset]]
+            with run_trace.phase("plan", offset=offset):
+                index = build_index(grids)
+                assignments = plan(index, requests_by_offset[offset], creds.login['users'], score=get_ranker().score)
+            results[offset] = book_plan(assignments, offset, index)
+
+    return results
+
+
+@run_trace.traced
 def book(days_in_future, start_time, end_time):
     """
     Helper function to make booking a lil easier.
@@ -372,4 +879,4 @@ def book(days_in_future, start_time, end_time):
     (int) Start time of desired booking, in seconds since midnight (i know this is stupid)
     (int) End time of desired booking, in seconds since midnight
     """
-    return make_booking(get_requested_times(days_in_future, start_time, end_time), days_in_future)
+    return book_windows(days_in_future, [(start_time, end_time)])
@@ -1,8 +1,15 @@
 rm my-deployment-package.zip
 cd venv/lib/python3.8/site-packages
-zip -r ../../../../my-deployment-package.zip .
+# Only ship what the Lambda imports. Packaging tools, the Slack client, caches and tests
+# just make the zip bigger and the cold start slower
+zip -r -q ../../../../my-deployment-package.zip . \
+    -x "pip/*" "pip-*" "setuptools/*" "setuptools-*" "pkg_resources/*" "_distutils_hack/*" "wheel/*" "wheel-*" \
+    -x "slackclient/*" "slack/*" "slack_sdk/*" "websocket/*" \
+    -x "*/__pycache__/*" "*/tests/*" "*/test/*"
 cd ../../../../
-zip -d my-deployment-package.zip pip
-zip -g my-deployment-package.zip *.py
-zip -g my-deployment-package.zip *.json
-aws lambda update-function-code --function-name BookingBot --zip-file fileb://my-deployment-package.zip
\ No newline at end of file
+# Everything except the Slack bot and the legacy scraper
+zip -g my-deployment-package.zip *.py -x slack.py book.py
+zip -g my-deployment-package.zip login.json group_names.json snag_times.json
+# Room preferences are optional
+[ -f ranking.json ] && zip -g my-deployment-package.zip ranking.json
+aws lambda update-function-code --function-name BookingBot --zip-file fileb://my-deployment-package.zip
@@ -0,0 +1,165 @@
+'''
+Submits planned bookings for different accounts at the same time. Every half hour slot being
+booked is claimed first, so two workers never go after the same room or time.
+'''
+import time
+import threading
+from dataclasses import dataclass
+
+import run_trace
+from planner import assign, remaining_quota
+from utils import SLOT_SECONDS
+
+# Accounts booking at the same time
+MAX_CONCURRENT_BOOKINGS = 4
+
+# Booking outcomes
+BOOKED = "booked"
+# The account has used up its daily limit
+MAXED = "maxed"
+LOGIN_FAILED = "login failed"
+# Someone else got the room first
+TAKEN = "taken"
+# The site turned the booking down without saying why we recognise
+REJECTED = "rejected"
+# Outcomes that mean the account can't book anything else
+ACCOUNT_DONE = (MAXED, LOGIN_FAILED)
+
+
+@dataclass
+class Attempt:
+    """ One booking request and how it went. """
+    cell: object
+    user: dict
+    outcome: str
+    # Seconds the attempt took
+    elapsed: float
+    # Whether the booking showed up on the day page afterwards, None until checked
+    confirmed: bool = None
+    booking_id: int = None
+
+    def __repr__(self):
+        checked = "" if self.confirmed is None else (" (confirmed)" if self.confirmed else " (NOT on the page)")
+        return f"{self.cell} as {self.user['username']}: {self.outcome}{checked} in {self.elapsed * 1000:.0f}ms"
+
+
+class SlotClaims():
+    """
+    Rooms and times currently being booked (or already booked) by some worker.
+
+    Claims made through views from scoped() share rooms but not times, so several groups
+    booking at once never go for the same room while each still gets one room per time.
+    """
+
+    def __init__(self, scope=None, shared=None):
+        self.scope = scope
+        self._claimed = set() if shared is None else shared._claimed
+        self._lock = threading.Lock() if shared is None else shared._lock
+
+    def scoped(self, scope):
+        return SlotClaims(scope, self)
+
+    def keys(self, cell):
+        slots = range(cell.time // SLOT_SECONDS, (cell.time + cell.duration) // SLOT_SECONDS)
+        # One room per time, and one booking per room and time
+        return [("time", self.scope, slot) for slot in slots] + [("room", cell.room_meta.id, slot) for slot in slots]
+
+    def claim(self, cell):
+        """ Claim every slot 'cell' covers. Returns False, claiming nothing, if any are taken. """
+        keys = self.keys(cell)
+        with self._lock:
+            if any(key in self._claimed for key in keys):
+                return False
+            self._claimed.update(keys)
+            return True
+
+    def release(self, cell):
+        with self._lock:
+            self._claimed.difference_update(self.keys(cell))
+
+
+class Dispatcher():
+    """
+    Books a list of Assignments with one worker per account, at most 'max_workers' at once.
+
+    'book_one(cell, user)' makes a single booking request and returns one of the outcomes above.
+    'alternatives(cell)' returns other cells covering the same time, tried in order when
+    'cell' can't be booked.
+    """
+
+    def __init__(self, book_one, alternatives=None, max_workers=MAX_CONCURRENT_BOOKINGS, claims=None):
+        self.book_one = book_one
+        self.alternatives = alternatives or (lambda cell: [])
+        self.max_workers = max_workers
+        self.claims = claims or SlotClaims()
+        self.attempts = []
+        self._lock = threading.Lock()
+
+    def attempt(self, cell, user):
+        """ Claim and try to book 'cell'. Returns the outcome, or None if it was already claimed. """
+        if not self.claims.claim(cell):
+            return None
+        started = time.perf_counter()
+        try:
+            outcome = self.book_one(cell, user)
+        except Exception:
+            self.claims.release(cell)
+            raise
+        with self._lock:
+            self.attempts.append(Attempt(cell, user, outcome, time.perf_counter() - started))
+        if outcome != BOOKED:
+            self.claims.release(cell)
+        return outcome
+
+    def work(self, user, cells):
+        """
+        Book 'cells' one after another with 'user'. Returns the cells left over if the account
+        gives out part way through.
+        """
+        for i, cell in enumerate(cells):
+            for option in [cell] + list(self.alternatives(cell)):
+                outcome = self.attempt(option, user)
+                if outcome == BOOKED:
+                    break
+                if outcome in ACCOUNT_DONE:
+                    return cells[i:]
+        return []
+
+    def run(self, assignments, users, remaining=None):
+        """
+        Book every assignment. Cells an account couldn't book are handed to the accounts that
+        still work and have quota left ('remaining', seconds per username) in later rounds.
+        Returns the list of Attempts.
+        """
+        remaining = dict(remaining if remaining is not None else remaining_quota(users))
+        queues = {}
+        for assignment in assignments:
+            queues.setdefault(assignment.user['username'], []).append(assignment.cell)
+        by_name = {user['username']: user for user in users}
+        done = set()
+
+        while queues:
+            with run_trace.ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(queues)))) as pool:
+                futures = {name: pool.submit(self.work, by_name[name], cells) for name, cells in queues.items()}
+                leftover = {name: future.result() for name, future in futures.items()}
+
+            orphans = []
+            for name, cells in leftover.items():
+                if cells:
+                    done.add(name)
+                    orphans += cells
+            available = [user for name, user in by_name.items() if name not in done]
+            if not orphans or not available:
+                break
+
+            # Share the orphaned cells out between the accounts still going
+            left = dict(remaining)
+            for attempt in self.attempts:
+                if attempt.outcome == BOOKED:
+                    left[attempt.user['username']] = left.get(attempt.user['username'], 0) - attempt.cell.duration
+            reassigned, _ = assign(orphans, available, left)
+            queues = {}
+            for assignment in reassigned:
+                queues.setdefault(assignment.user['username'], []).append(assignment.cell)
+
+        return self.attempts
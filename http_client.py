@@ -0,0 +1,229 @@
+'''
+Every request to the study room site goes through an HttpClient, which gives it:
+
+- a per-host token bucket, shared by every client in the process, that halves its rate when
+  the site answers 429/503 and creeps back up while it's healthy. This replaces the old
+  hard coded time.sleep(5) per scrape.
+- connect and read timeouts, so one stuck response can't stall a whole Lambda run.
+- retries with jittered exponential backoff on connection errors and transient statuses.
+- hedged requests for submissions: if the first copy hasn't answered in time a second one
+  is sent and whichever succeeds first wins.
+
+requests is imported lazily like in bookV2, so importing this costs nothing at cold start.
+'''
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# (connect, read) timeout in seconds
+DEFAULT_TIMEOUT = (3.05, 10)
+# Attempts after the first one
+DEFAULT_RETRIES = 3
+# Backoff before retry n is uniform in [0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** n)]
+BACKOFF_BASE = 0.25
+BACKOFF_CAP = 4.0
+# Statuses worth trying again
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+# Statuses meaning we're going too fast
+THROTTLE_STATUSES = {429, 503}
+
+# Requests per second allowed to one host, and how many can go back to back
+MAX_RATE = 10.0
+MIN_RATE = 0.2
+BURST = 20
+# Added to the rate after every healthy response, up to MAX_RATE
+RATE_STEP = 0.5
+
+# Seconds to wait for a submission before sending a second copy
+HEDGE_AFTER = 0.5
+# Threads sending hedged requests, shared by every client. Two per submission in flight, with
+# room for an armed run firing every account at once. Threads are only started when needed
+HEDGE_WORKERS = 64
+
+
+class TokenBucket():
+    """ Rate limiter for one host. The rate adapts to how the host is coping. """
+
+    def __init__(self, rate=MAX_RATE, burst=BURST, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.max_rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """ Take a token, waiting for one if the bucket is empty. """
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate
+            self._sleep(wait_for)
+
+    def slow_down(self):
+        """ The host is struggling: halve the rate and drop any saved up burst. """
+        with self._lock:
+            self._refill()
+            self.rate = max(MIN_RATE, self.rate / 2)
+            self._tokens = min(self._tokens, 1.0)
+
+    def speed_up(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill()
+                self.rate = min(self.max_rate, self.rate + RATE_STEP)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def bucket_for(url):
+    """ The process wide TokenBucket for the host of 'url'. """
+    host = urlsplit(url).netloc
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            bucket = _buckets[host] = TokenBucket()
+        return bucket
+
+
+_hedges = None
+_hedges_lock = threading.Lock()
+
+
+def hedge_pool():
+    """ The process wide pool hedged requests are sent from. """
+    global _hedges
+    with _hedges_lock:
+        if _hedges is None:
+            _hedges = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+        return _hedges
+
+
+def backoff(attempt):
+    """ Seconds to wait before retry number 'attempt' (0 based), with full jitter. """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def retry_after(resp):
+    """ The Retry-After header in seconds, if the site sent a usable one. """
+    try:
+        return min(BACKOFF_CAP, float(resp.headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpClient():
+    """
+    A requests session with rate limiting, timeouts and retries. get and post take the same
+    arguments as the requests.Session ones.
+    """
+
+    def __init__(self, pool_size=4, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, sleep=time.sleep):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.timeout = timeout
+        self.retries = retries
+        self._sleep = sleep
+
+    @property
+    def cookies(self):
+        return self.session.cookies
+
+    def request(self, method, url, idempotent=True, **kwargs):
+        """
+        Send a request, retrying connection errors and transient statuses. Requests that
+        aren't 'idempotent' are only retried when they can't have reached the site: failed
+        connections and throttling responses. Raises the last error once out of retries.
+        """
+        import requests
+
+        kwargs.setdefault("timeout", self.timeout)
+        bucket = bucket_for(url)
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            bucket.acquire()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except requests.exceptions.ConnectTimeout:
+                # Never reached the site, always safe to send again
+                if last:
+                    raise
+                self._sleep(backoff(attempt))
+                continue
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                # Dropped connections and read timeouts may have gone through already
+                if last or not idempotent:
+                    raise
+                self._sleep(backoff(attempt))
+                continue
+
+            if resp.status_code in THROTTLE_STATUSES:
+                bucket.slow_down()
+            else:
+                bucket.speed_up()
+            retryable = resp.status_code in (TRANSIENT_STATUSES if idempotent else THROTTLE_STATUSES)
+            if last or not retryable:
+                return resp
+            wait_for = retry_after(resp)
+            self._sleep(backoff(attempt) if wait_for is None else wait_for)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, data=None, idempotent=False, **kwargs):
+        return self.request("POST", url, idempotent=idempotent, data=data, **kwargs)
+
+    def hedged_post(self, url, data=None, accept=None, hedge_after=HEDGE_AFTER, **kwargs):
+        """
+        Post 'data', sending a second copy if the first hasn't answered within 'hedge_after'
+        seconds. Returns the first response 'accept' is happy with, otherwise the first one
+        to arrive. Only for requests where a duplicate is harmless, eg. booking a room the
+        other copy may already have booked just fails with a conflict.
+        """
+        accept = accept or (lambda resp: resp.ok)
+        hedges = hedge_pool()
+        send = lambda: self.post(url, data, **kwargs)
+
+        pending = {hedges.submit(send)}
+        done, _ = wait(pending, timeout=hedge_after)
+        if not done:
+            pending.add(hedges.submit(send))
+
+        first = None
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    resp = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if accept(resp):
+                    return resp
+                first = first or resp
+        if first is None:
+            raise error
+        return first
+
+    def close(self):
+        self.session.close()
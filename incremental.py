@@ -0,0 +1,114 @@
+'''
+Repeated polling of day pages that only reports what changed since the last poll.
+
+Unchanged pages are skipped without parsing: the site is asked with If-None-Match /
+If-Modified-Since when it gave us an ETag or Last-Modified, and otherwise the day_main
+table is hashed and compared with the last one seen.
+'''
+import hashlib
+import threading
+import datetime as dt
+from dataclasses import dataclass, field
+
+import bookV2
+import run_trace
+from utils import DayGrid, to_uvic_url
+
+
+@dataclass
+class Delta:
+    """ What changed on one (date, area) page since the last poll. """
+    date: dt.date
+    area: int
+    # Free cells that weren't free last time
+    freed: list = field(default_factory=list)
+    # Cells that were free last time and aren't any more
+    taken: list = field(default_factory=list)
+    # True on the first poll of a page, when every free cell counts as freed
+    first: bool = False
+
+    def changed(self):
+        return bool(self.freed or self.taken)
+
+    def freed_between(self, start, end):
+        """ Freed cells starting in [start, end). """
+        return [cell for cell in self.freed if cell.is_between_times(start, end)]
+
+
+@dataclass
+class PageState:
+    """ The last version of a page we saw. """
+    etag: str = None
+    last_modified: str = None
+    table_hash: str = None
+    # (room id, time) -> free cell
+    free: dict = field(default_factory=dict)
+
+
+def free_slots(cells):
+    """ Map every free half hour slot in 'cells' to its cell. """
+    return {(cell.room_meta.id, cell.time): cell for cell in cells if not cell.is_booked()}
+
+
+class IncrementalScraper():
+    """ Polls day pages and keeps the last parsed grid of each (date, area). """
+
+    def __init__(self, session=None, parser=None):
+        self.session = session or bookV2.make_session()
+        self.parser = parser
+        self.pages = {}
+        self._lock = threading.Lock()
+
+    def poll(self, date, area):
+        """ Fetch (date, area) and return a Delta against the last poll of it. """
+        with self._lock:
+            state = self.pages.get((date, area))
+        first = state is None
+        state = state or PageState()
+
+        headers = dict(bookV2.header)
+        if state.etag:
+            headers["If-None-Match"] = state.etag
+        if state.last_modified:
+            headers["If-Modified-Since"] = state.last_modified
+
+        url = to_uvic_url(date.day, date.month, date.year, area, bookV2.urlBase)
+        with run_trace.phase("fetch", area=area, date=str(date)):
+            resp = self.session.get(url, headers=headers, verify=False)
+        if resp.status_code == 304:
+            return Delta(date, area)
+
+        table = bookV2.day_main_html(resp.text)
+        table_hash = hashlib.blake2b(table.encode(), digest_size=16).hexdigest()
+        if table_hash == state.table_hash:
+            return Delta(date, area)
+
+        with run_trace.phase("parse", area=area, date=str(date)):
+            cells = bookV2.parse_day(resp.text, area, date.day, self.parser)
+        # Anyone else scraping this page gets the fresh copy too
+        bookV2.availability_cache.put(date, area, DayGrid.from_cells(cells, area, date.day, bookV2.Cell))
+
+        free = free_slots(cells)
+        delta = Delta(
+            date, area,
+            freed=[cell for key, cell in free.items() if key not in state.free],
+            taken=[cell for key, cell in state.free.items() if key not in free],
+            first=first
+        )
+        with self._lock:
+            self.pages[(date, area)] = PageState(
+                resp.headers.get("ETag"), resp.headers.get("Last-Modified"), table_hash, free
+            )
+        return delta
+
+    def poll_many(self, targets, max_workers=bookV2.MAX_CONCURRENT_SCRAPES):
+        """ Poll several (date, area) pages in parallel and return the Deltas that changed. """
+        with run_trace.ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            deltas = list(pool.map(lambda target: self.poll(*target), targets))
+        return [delta for delta in deltas if delta.changed()]
+
+    def forget(self, date, area=None):
+        """ Drop the stored grid for (date, area), or every area on 'date'. """
+        with self._lock:
+            for key in [k for k in self.pages if k[0] == date and area in (None, k[1])]:
+                del self.pages[key]
@@ -1,8 +1,28 @@
-import urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+'''
+AWS Lambda entry point. Nothing heavy is imported until the first invocation, and what gets
+set up then (logged in sessions, parsed config, scraped pages) is kept for warm invocations.
+
+The event can override the environment: {"offsets": "1-7", "fire_at": "00:00"}
+'''
+_started = False
+
+
+def handler(event=None, context=None):
+    global _started
+    if not _started:
+        import urllib3
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+        _started = True
 
-def main(event, context):
     import room_snag
+    event = event or {}
+    # Armed mode must not sleep past the Lambda's own timeout
+    time_left = context.get_remaining_time_in_millis() / 1000 if context is not None else None
+    room_snag.main(event.get("offsets"), event.get("fire_at"), time_left)
+
+
+# Existing deployments are configured with lambda_function.main as the handler
+main = handler
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    handler()
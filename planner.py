@@ -0,0 +1,111 @@
+'''
+Plans a whole booking run before anything is submitted: which rooms to book to cover the
+requested times, and which account books each one without going over its daily limit.
+'''
+from dataclasses import dataclass
+
+from utils import SLOT_SECONDS, MAX_BOOKING_SECONDS, slot_mask
+
+# UVic won't let an account hold more than 2 hours a day
+DAILY_QUOTA_SECONDS = 7200
+
+
+@dataclass
+class Assignment:
+    """ A free cell to book and the account that should book it. """
+    cell: object
+    user: dict
+
+    def __repr__(self):
+        return f"{self.cell} -> {self.user['username']}"
+
+
+def remaining_quota(users, used=None):
+    """
+    Seconds each account can still book today, keyed by username. 'used' maps usernames to
+    seconds already booked.
+
+    The site doesn't say which account made a booking, only the group name, so callers don't
+    know 'used' and every account is assumed to have its full quota. An account that turns out
+    to be maxed out is found when it's refused and its cells go to the others (see dispatch).
+    """
+    used = used or {}
+    return {user['username']: max(0, DAILY_QUOTA_SECONDS - used.get(user['username'], 0)) for user in users}
+
+
+def plan_window(index, start, end, max_duration=MAX_BOOKING_SECONDS, score=None):
+    """
+    Choose bookings from the SlotIndex 'index' covering [start, end).
+
+    Covers as many slots as possible, then uses as few bookings as possible, then prefers
+    the best rooms by 'score' (a function scoring a room, quality by default). Returns the
+    chosen free cells in time order.
+    """
+    score = score or (lambda room: room.quality)
+    first = -(-int(start) // SLOT_SECONDS)
+    n = max(0, -(-int(end) // SLOT_SECONDS) - first)
+    max_slots = max_duration // SLOT_SECONDS
+    quality = {room_id: score(cell.room_meta) for room_id, cell in index.templates.items()}
+
+    # best[i] is the best (covered slots, -bookings, quality) for the first i slots, along with
+    # how it was reached: (previous i, room id or None if slot i - 1 is left uncovered)
+    best = [((0, 0, 0), None)] + [None] * n
+    for i in range(1, n + 1):
+        value, _ = best[i - 1]
+        best[i] = (value, (i - 1, None))
+
+        for length in range(1, min(max_slots, i) + 1):
+            mask = slot_mask((first + i - length) * SLOT_SECONDS, (first + i) * SLOT_SECONDS)
+            rooms = [room_id for room_id, free in index.free.items() if free & mask == mask]
+            if not rooms:
+                # Longer bookings need these slots too
+                break
+            room_id = max(rooms, key=lambda r: quality[r])
+            (covered, bookings, total_quality), _ = best[i - length]
+            value = (covered + length, bookings - 1, total_quality + quality[room_id] * length)
+            if value > best[i][0]:
+                best[i] = (value, (i - length, room_id))
+
+    cells = []
+    i = n
+    while i > 0:
+        previous, room_id = best[i][1]
+        if room_id is not None:
+            cells.append(index.cell(room_id, (first + previous) * SLOT_SECONDS, (i - previous) * SLOT_SECONDS))
+        i = previous
+    return cells[::-1]
+
+
+def assign(cells, users, remaining=None):
+    """
+    Give every cell to an account with enough quota left, longest bookings first, each going
+    to the account it fits most tightly. Returns the assignments in time order and the cells
+    no account had room for.
+    """
+    remaining = dict(remaining if remaining is not None else remaining_quota(users))
+    assignments = []
+    leftover = []
+    for cell in sorted(cells, key=lambda c: c.duration, reverse=True):
+        fits = [user for user in users if remaining.get(user['username'], 0) >= cell.duration]
+        if not fits:
+            leftover.append(cell)
+            continue
+        user = min(fits, key=lambda u: remaining[u['username']])
+        remaining[user['username']] -= cell.duration
+        assignments.append(Assignment(cell, user))
+
+    assignments.sort(key=lambda a: (a.cell.time, a.cell.room_meta.id))
+    return assignments, leftover
+
+
+def plan(index, windows, users, remaining=None, score=None):
+    """
+    Plan bookings for every (start, end) window on one day, sharing the accounts' quota
+    between them. 'remaining' is the quota left per username, the full quota when not given
+    (see remaining_quota). Returns a list of Assignments.
+    """
+    cells = []
+    for start, end in windows:
+        cells += plan_window(index, start, end, score=score)
+    assignments, _ = assign(cells, users, remaining)
+    return assignments
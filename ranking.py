@@ -0,0 +1,123 @@
+'''
+Decides which rooms we'd rather have. Every room gets a score once, when the Ranker is made,
+from its quality, its floor, any per-room preferences in ranking.json and how often booking it
+has worked before. Ranking candidates after that is a dict lookup per cell.
+
+ranking.json (see ranking-sample.json) is optional and needs no code changes:
+
+    {
+        "weights": {"quality": 1, "success": 2},
+        "floors": {"BASEMENT": -3},
+        "rooms": {"Room A109": 2},
+        "exclude": ["Room 050A"]
+    }
+
+'floors' and 'rooms' are added to the score, 'exclude' rooms are never booked. The booking
+history is kept in /tmp/bookingbot-history.json, or BOOKINGBOT_HISTORY if set.
+'''
+import os
+import json
+import threading
+
+from dispatch import ACCOUNT_DONE, BOOKED
+
+DEFAULT_WEIGHTS = {"quality": 1.0, "success": 2.0}
+DEFAULT_HISTORY = os.path.join("/tmp", "bookingbot-history.json")
+EXCLUDED = float("-inf")
+
+
+class History():
+    """ How many times booking each room was tried and worked, saved as JSON. """
+
+    def __init__(self, path=None):
+        self.path = path
+        # room id -> [booked, tried]
+        self.counts = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.counts = {int(room_id): counts for room_id, counts in json.load(f).items()}
+            except (OSError, ValueError):
+                print(f"Ignoring unreadable booking history {path}")
+
+    def success_rate(self, room_id):
+        """ Share of attempts on 'room_id' that worked, starting from 1/2 with no history. """
+        booked, tried = self.counts.get(room_id, (0, 0))
+        return (booked + 1) / (tried + 2)
+
+    def record(self, attempts):
+        """ Count the outcomes of Dispatcher attempts. Account problems say nothing about the room. """
+        with self._lock:
+            for attempt in attempts:
+                if attempt.outcome in ACCOUNT_DONE:
+                    continue
+                counts = self.counts.setdefault(attempt.cell.room_meta.id, [0, 0])
+                counts[0] += attempt.outcome == BOOKED
+                counts[1] += 1
+            if self.path is not None:
+                try:
+                    with open(self.path, "w") as f:
+                        json.dump(self.counts, f)
+                except OSError as e:
+                    print(f"Couldn't save booking history: {e}")
+
+
+class Ranker():
+    """ Precomputed score for every room. Higher is better. """
+
+    def __init__(self, rooms, config=None, history=None):
+        config = config or {}
+        self.weights = dict(DEFAULT_WEIGHTS, **config.get("weights", {}))
+        self.floors = config.get("floors", {})
+        self.room_bonus = config.get("rooms", {})
+        self.exclude = set(config.get("exclude", []))
+        self.history = history or History()
+        self.scores = {}
+        for room in rooms:
+            self.scores[room.id] = self._score(room)
+
+    def _score(self, room):
+        if room.name in self.exclude or room.id in self.exclude:
+            return EXCLUDED
+        floor = getattr(room.floor, "name", room.floor)
+        return (
+            self.weights["quality"] * room.quality
+            + self.floors.get(floor, 0)
+            + self.room_bonus.get(room.name, 0)
+            + self.weights["success"] * self.history.success_rate(room.id)
+        )
+
+    def score(self, room):
+        """ Score of 'room'. Rooms we didn't know about at startup are scored on first sight. """
+        score = self.scores.get(room.id)
+        if score is None:
+            score = self.scores[room.id] = self._score(room)
+        return score
+
+    def acceptable(self, room):
+        return self.score(room) != EXCLUDED
+
+
+def load_config(path=None):
+    """ ranking.json (or 'path'), or an empty config if there isn't one. """
+    path = path or os.environ.get("BOOKINGBOT_RANKING", "ranking.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+_ranker = None
+_ranker_lock = threading.Lock()
+
+
+def get_ranker():
+    """ The Ranker for every known room, built on first use and then reused. """
+    global _ranker
+    with _ranker_lock:
+        if _ranker is None:
+            from room_catalog import get_catalog
+            history = History(os.environ.get("BOOKINGBOT_HISTORY", DEFAULT_HISTORY))
+            _ranker = Ranker(get_catalog().all(), load_config(), history)
+        return _ranker
@@ -0,0 +1,182 @@
+'''
+Every bookable room the site has, learned from the data-room headers of the day pages as they
+are scraped rather than hard coded, so a new room can't break a run. What we know about rooms
+(quality, floor) is kept in Rooms below and overrides whatever was learned.
+
+The catalog is saved to /tmp/bookingbot-rooms.json (BOOKINGBOT_ROOMS to move it) so a new
+process knows which rooms are in which area without asking the site. Entries older than
+CATALOG_TTL are treated as unknown and learned again from the next scrape.
+'''
+import os
+import json
+import time
+import threading
+from enum import Enum
+from dataclasses import dataclass
+
+# Bump when the file layout changes, older files are ignored
+CATALOG_VERSION = 1
+CATALOG_TTL = 7 * 24 * 3600
+DEFAULT_PATH = os.path.join("/tmp", "bookingbot-rooms.json")
+# Quality of a room we've never rated
+DEFAULT_QUALITY = 3
+
+
+class Floors(Enum):
+    BASEMENT = 0
+    FIRST = 1
+    SECOND = 2
+
+
+# Which floor each area is on
+AREA_FLOORS = {1: Floors.FIRST, 2: Floors.BASEMENT, 3: Floors.SECOND}
+
+
+@dataclass
+class Room:
+    """
+    Represents a bookable room. Quality ranges from 0 to 10. Quality does not have to be unique
+    """
+    quality: int
+    floor: Floors
+    name: str
+    id: int
+
+@dataclass
+class Rooms(Enum):
+
+    ROOM113A = Room(quality=5, floor=Floors.FIRST, name='Room 113a', id=1)
+    ROOM113B = Room(quality=4, floor=Floors.FIRST, name='Room 113b', id=2)
+    ROOM113C = Room(quality=3, floor=Floors.FIRST, name='Room 113c', id=3)
+    ROOM113D = Room(quality=8, floor=Floors.FIRST, name='Room 113d', id=4)
+    ROOM131 = Room(quality=8, floor=Floors.FIRST, name='Room 131', id=5)
+    ROOMA103 = Room(quality=6, floor=Floors.FIRST, name='Room A103', id=6)
+    ROOMA105 = Room(quality=7, floor=Floors.FIRST, name='Room A105', id=7)
+    ROOMA107 = Room(quality=9, floor=Floors.FIRST, name='Room A107', id=8)
+    ROOMA109 = Room(quality=10, floor=Floors.FIRST, name='Room A109', id=9)
+    ROOM050A = Room(quality=1, floor=Floors.BASEMENT, name='Room 050A', id=10)
+    ROOM050B = Room(quality=1, floor=Floors.BASEMENT, name='Room 050B', id=11)
+    ROOM050C = Room(quality=1, floor=Floors.BASEMENT, name='Room 050C', id=12)
+    ROOM223 = Room(quality=2, floor=Floors.SECOND, name='Room 223', id=13)
+    ROOM270 = Room(quality=2, floor=Floors.SECOND, name='Room 270', id=14)
+    ROOM272 = Room(quality=2, floor=Floors.SECOND, name='Room 272', id=15)
+    ROOM274 = Room(quality=2, floor=Floors.SECOND, name='Room 274', id=16)
+
+
+# Our ratings of rooms by id, they win over anything learned from the site
+OVERRIDES = {room.value.id: room.value for room in Rooms}
+
+
+class RoomCatalog():
+    """ Rooms by id, and the rooms in each area. Safe to use from several threads. """
+
+    def __init__(self, path=None, clock=time.time):
+        self.path = path
+        self._clock = clock
+        # room id -> Room
+        self.rooms = dict(OVERRIDES)
+        # area -> (learned at, [room ids])
+        self.areas = {}
+        self._lock = threading.Lock()
+        if path is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get("version") != CATALOG_VERSION:
+            return
+        with self._lock:
+            for entry in saved["rooms"]:
+                if entry["id"] not in OVERRIDES:
+                    floor = None if entry["floor"] is None else Floors[entry["floor"]]
+                    self.rooms[entry["id"]] = Room(entry["quality"], floor, entry["name"], entry["id"])
+            self.areas = {int(area): (learned_at, ids) for area, (learned_at, ids) in saved["areas"].items()}
+
+    def save(self):
+        """ Write the catalog out. Failing to is only a slower start next time. """
+        if self.path is None:
+            return
+        with self._lock:
+            saved = {
+                "version": CATALOG_VERSION,
+                "rooms": [
+                    {"id": r.id, "name": r.name, "quality": r.quality, "floor": getattr(r.floor, "name", None)}
+                    for r in self.rooms.values()
+                ],
+                "areas": self.areas,
+            }
+        try:
+            tmp = f"{self.path}.{os.getpid()}"
+            with open(tmp, "w") as f:
+                json.dump(saved, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Couldn't save room catalog: {e}")
+
+    def room(self, room_id, name=None, area=None):
+        """ The Room for 'room_id'. Rooms we haven't seen before are added with a default rating. """
+        room = self.rooms.get(room_id)
+        if room is None:
+            with self._lock:
+                room = self.rooms.setdefault(
+                    room_id, Room(DEFAULT_QUALITY, AREA_FLOORS.get(area), name or f"Room {room_id}", room_id)
+                )
+        return room
+
+    def learn(self, area, headers):
+        """
+        Record the rooms listed in the header of a day page of 'area' as (room id, name) pairs.
+        Only touches the disk when something changed.
+        """
+        ids = [room_id for room_id, _ in headers]
+        with self._lock:
+            learned = self.areas.get(area)
+            if learned is not None and learned[1] == ids and not self._expired(learned):
+                return
+            self.areas[area] = (self._clock(), ids)
+        for room_id, name in headers:
+            self.room(room_id, name, area)
+        self.save()
+
+    def _expired(self, learned):
+        return self._clock() - learned[0] > CATALOG_TTL
+
+    def rooms_in(self, area):
+        """ Rooms in 'area', or None if we don't know (or our knowledge is too old). """
+        learned = self.areas.get(area)
+        if learned is None or self._expired(learned):
+            return None
+        return [self.rooms[room_id] for room_id in learned[1] if room_id in self.rooms]
+
+    def useful_areas(self, areas, acceptable):
+        """
+        The areas worth scraping: those with at least one room 'acceptable' says yes to, and
+        any we don't know the rooms of yet.
+        """
+        useful = []
+        for area in areas:
+            rooms = self.rooms_in(area)
+            if rooms is None or any(acceptable(room) for room in rooms):
+                useful.append(area)
+        return useful
+
+    def all(self):
+        with self._lock:
+            return list(self.rooms.values())
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """ The process wide catalog, loaded from disk on first use. """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = RoomCatalog(os.environ.get("BOOKINGBOT_ROOMS", DEFAULT_PATH))
+        return _catalog
@@ -1,38 +1,107 @@
 '''
 Run this after the library closes for the day. Rooms are booked 1 week in advance
+
+Set SNAG_FIRE_AT to a Pacific time (eg. "00:00") to run in armed mode: everything is
+prepared straight away and the bookings are all submitted the instant that time comes around.
+
+Set SNAG_OFFSETS to book several days in one run, eg. "1-7" for every day of the coming week
+or "5,6,7" to catch up after missed nights. Each day uses its own weekday from snag_times.json.
 '''
-from bookV2 import book
+from bookV2 import book_days
 import datetime as dt
+import os
 import sys
 import json
 import pytz
 
-target_day = dt.datetime.now(pytz.timezone('US/Pacific')).date()
-weekday = target_day.strftime('%A')
 
-try:
-    with open("snag_times.json") as f:
-        booking_times = json.load(f)[weekday]
-except:
-    print(f"Error loading snag_times.json")
-    sys.exit(0)
+def parse_offsets(spec):
+    """ Turn "1-7" or "5,6,7" into a list of days in the future. """
+    offsets = []
+    for part in spec.split(','):
+        first, _, last = part.strip().partition('-')
+        offsets += range(int(first), int(last or first) + 1)
+    return sorted(set(offsets))
 
-for times in booking_times:
-    # This supports multiple non-continuous booking slots
-    start_str = times['bookingStart']
-    end_str = times['bookingEnd']
 
-    start_h, start_m = map(int, start_str.split(':'))
-    end_h, end_m = map(int, end_str.split(':'))
+def to_windows(booking_times):
+    """ Convert snag_times.json entries to (start, end) tuples in seconds since midnight. """
+    windows = []
+    for times in booking_times:
+        # This supports multiple non-continuous booking slots
+        start_str = times['bookingStart']
+        end_str = times['bookingEnd']
 
-    start = dt.timedelta(hours=start_h, minutes=start_m)
-    end = dt.timedelta(hours=end_h, minutes=end_m)
+        start_h, start_m = map(int, start_str.split(':'))
+        end_h, end_m = map(int, end_str.split(':'))
 
-    for i in range(1,4): # Run through all the floors
-        result = book(7, start.total_seconds(), end.total_seconds())
-        if result == "No rooms found":
-            if i == 3: #If we're on the last floor and nothing was found
-                print(f"Nothing found from {start_str}-{end_str}")
-            continue
+        start = dt.timedelta(hours=start_h, minutes=start_m)
+        end = dt.timedelta(hours=end_h, minutes=end_m)
+        windows.append((start.total_seconds(), end.total_seconds()))
+    return windows
+
+
+_snag_times = None
+
+
+def load_snag_times():
+    """ snag_times.json, loaded once and reused by warm Lambda invocations. """
+    global _snag_times
+    if _snag_times is None:
+        try:
+            with open("snag_times.json") as f:
+                _snag_times = json.load(f)
+        except:
+            print(f"Error loading snag_times.json")
+            sys.exit(0)
+    return _snag_times
+
+
+def main(offsets=None, fire_at=None, time_left=None):
+    """
+    Book every day in 'offsets' (a SNAG_OFFSETS style string, default "7"). If 'fire_at' is a
+    Pacific time the furthest day is booked in armed mode at that instant.
+    Both fall back to the environment variables described at the top of this file.
+
+    'time_left' is how many seconds this run may take (eg. what's left of the Lambda's
+    timeout). If 'fire_at' is further away than that the days are booked straight away instead.
+    """
+    offsets = offsets or os.environ.get("SNAG_OFFSETS", "7")
+    fire_at = fire_at or os.environ.get("SNAG_FIRE_AT")
+
+    today = dt.datetime.now(pytz.timezone('US/Pacific')).date()
+    day_shift = 0
+    if fire_at:
+        import armed
+        fire_at = armed.next_instant(fire_at)
+        if armed.can_wait(fire_at, time_left):
+            # The window might open tomorrow, book a week out from then
+            day_shift = (fire_at.date() - today).days
         else:
-            break
+            print(f"Can't wait until {fire_at} with {time_left:.0f}s left, not arming")
+            fire_at = None
+    offsets = [offset + day_shift for offset in parse_offsets(offsets)]
+
+    snag_times = load_snag_times()
+
+    # Rooms are wanted on the same weekday as the day being booked
+    windows = {offset: to_windows(snag_times[(today + dt.timedelta(days=offset)).strftime('%A')]) for offset in offsets}
+
+    # Only the furthest day opens at the armed instant, any others can be booked straight away
+    armed_offset = offsets[-1] if fire_at else None
+
+    # Every slot for a day is planned together so the accounts' 2 hour limits are shared out
+    results = book_days({o: w for o, w in windows.items() if o != armed_offset})
+    for offset, result in results.items():
+        if result == "No rooms found":
+            print(f"Nothing found {offset} days out")
+
+    if armed_offset is not None and windows[armed_offset]:
+        results[armed_offset] = armed.arm(armed_offset, windows[armed_offset], fire_at)
+        if results[armed_offset] == "No rooms found":
+            print("Nothing found to arm")
+    return results
+
+
+if __name__ == "__main__":
+    main()
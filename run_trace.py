@@ -0,0 +1,186 @@
+'''
+Timing for the booking hot path. Code wraps each step in phase("fetch"), phase("login") etc.
+and every booking run emits one JSON trace of them, so the logs show whether a missed room
+was lost to slow logins, parsing or submissions.
+
+Tracing is off unless BOOKINGBOT_TRACE is set ("stdout" or a file to append JSON lines to)
+or a sink is passed to set_sink(). BOOKINGBOT_PROFILE=1 also runs each booking run under
+cProfile and prints the slowest functions.
+'''
+import os
+import sys
+import json
+import time
+import uuid
+import functools
+import threading
+import contextvars
+from concurrent import futures
+from contextlib import contextmanager
+
+# Functions listed when profiling
+PROFILE_LINES = 25
+
+
+def stdout_sink(trace):
+    """ Print the trace as one JSON line, which is what ends up in the Lambda logs. """
+    print(json.dumps(trace), flush=True)
+
+
+def file_sink(path):
+    """ Sink appending each trace as a JSON line to 'path'. """
+    def sink(trace):
+        with open(path, "a") as f:
+            f.write(json.dumps(trace) + "\n")
+    return sink
+
+
+class ListSink():
+    """ Keeps traces in memory, handy for benchmarks. """
+
+    def __init__(self):
+        self.traces = []
+
+    def __call__(self, trace):
+        self.traces.append(trace)
+
+
+def sink_from_env():
+    target = os.environ.get("BOOKINGBOT_TRACE")
+    if not target:
+        return None
+    return stdout_sink if target == "stdout" else file_sink(target)
+
+
+class Tracer():
+    """ Collects the phases of one run. Safe to use from several threads. """
+
+    def __init__(self, name):
+        self.name = name
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.phases = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name, **fields):
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            record = {
+                "phase": name,
+                "at_ms": round((started - self._started) * 1000, 3),
+                "ms": round((time.perf_counter() - started) * 1000, 3),
+                "thread": threading.current_thread().name,
+            }
+            record.update(fields)
+            if error:
+                record["error"] = error
+            with self._lock:
+                self.phases.append(record)
+
+    def to_dict(self, **summary):
+        totals = {}
+        for record in self.phases:
+            total = totals.setdefault(record["phase"], {"count": 0, "ms": 0.0})
+            total["count"] += 1
+            total["ms"] = round(total["ms"] + record["ms"], 3)
+        trace = {
+            "run": self.name,
+            "run_id": self.run_id,
+            "started_at": self.started_at,
+            "ms": round((time.perf_counter() - self._started) * 1000, 3),
+            "totals": totals,
+            "phases": sorted(self.phases, key=lambda r: r["at_ms"]),
+        }
+        trace.update(summary)
+        return trace
+
+
+_sink = sink_from_env()
+# The Tracer of the run the caller is part of. Runs going at the same time (eg. Slack jobs)
+# each have their own, and ThreadPoolExecutor below carries it into worker threads
+_current = contextvars.ContextVar("run_trace_current", default=None)
+_calls = threading.local()
+
+
+class ThreadPoolExecutor(futures.ThreadPoolExecutor):
+    """
+    A concurrent.futures ThreadPoolExecutor whose tasks belong to the run that submitted
+    them, so phases timed in worker threads end up in the right trace.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def set_sink(sink):
+    """ Send traces to 'sink' (a callable taking the trace dict), or turn tracing off with None. """
+    global _sink
+    _sink = sink
+
+
+@contextmanager
+def phase(name, **fields):
+    """ Time a step of the current run. Does nothing when no run is being traced. """
+    tracer = _current.get()
+    if tracer is None:
+        yield
+        return
+    with tracer.phase(name, **fields):
+        yield
+
+
+@contextmanager
+def run(name):
+    """
+    Trace everything inside as one run and hand the trace to the sink at the end.
+    Runs started from inside another run (in its thread or its ThreadPoolExecutor workers)
+    are folded into it, runs started anywhere else get their own trace.
+    """
+    outer = _current.get()
+    if outer is not None or _sink is None:
+        yield outer
+        return
+
+    tracer = Tracer(name)
+    token = _current.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current.reset(token)
+        _sink(tracer.to_dict())
+
+
+def traced(func):
+    """
+    Decorator making every call to 'func' a traced run, and profiled too when
+    BOOKINGBOT_PROFILE is set.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Only the outermost traced call gets profiled
+        depth = getattr(_calls, "depth", 0)
+        _calls.depth = depth + 1
+        try:
+            with run(func.__name__):
+                if depth or not os.environ.get("BOOKINGBOT_PROFILE"):
+                    return func(*args, **kwargs)
+
+                import cProfile
+                import pstats
+                profiler = cProfile.Profile()
+                try:
+                    return profiler.runcall(func, *args, **kwargs)
+                finally:
+                    print(f"Profile of {func.__name__}:")
+                    pstats.Stats(profiler, stream=sys.stdout).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        finally:
+            _calls.depth = depth
+    return wrapper
@@ -0,0 +1,144 @@
+'''
+Keeps logged in sessions (cookies and CSRF token) between runs, so a Lambda invocation, even
+a cold one on a reused /tmp, can skip the CAS login and only has to check the session still
+works. Sessions are stored per username and encrypted with Fernet.
+
+Stores only need load(username), save(username, state), delete(username) and clear(), so
+something like S3 or DynamoDB can be dropped in for FileSessionStore.
+
+Set BOOKINGBOT_SESSION_DIR to move the files (default /tmp/bookingbot-sessions),
+BOOKINGBOT_SESSION_KEY to a Fernet key to encrypt with (otherwise one is derived from
+login.json) or BOOKINGBOT_SESSION_DIR=off to turn it off.
+'''
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+
+DEFAULT_DIR = os.path.join("/tmp", "bookingbot-sessions")
+# Stored sessions older than this are logged in again rather than trusted
+MAX_AGE = 12 * 3600
+
+
+def session_state(cookies, csrf_token):
+    """ What gets stored for one session: its cookies and CSRF token. """
+    return {
+        "saved_at": time.time(),
+        "csrf_token": csrf_token,
+        "cookies": [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path, "expires": c.expires, "secure": c.secure}
+            for c in cookies
+        ],
+    }
+
+
+def restore_cookies(cookies, state):
+    """ Put the cookies from a stored 'state' into the cookie jar 'cookies'. """
+    for c in state["cookies"]:
+        cookies.set(c["name"], c["value"], domain=c["domain"], path=c["path"], expires=c["expires"], secure=c["secure"])
+
+
+def is_fresh(state, now=None):
+    """
+    Cheap check a stored session is worth trying, without touching the site: not too old and
+    none of its cookies have expired.
+    """
+    now = time.time() if now is None else now
+    if now - state.get("saved_at", 0) > MAX_AGE:
+        return False
+    return all(c["expires"] is None or c["expires"] > now for c in state["cookies"])
+
+
+def derive_key(path='login.json'):
+    """ A Fernet key derived from login.json, so it changes whenever the passwords do. """
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(b"bookingbot-session-store\0" + f.read()).digest()
+    return base64.urlsafe_b64encode(digest)
+
+
+class MemoryStore():
+    """ Keeps sessions in a dict, for benchmarks and trying things out. """
+
+    def __init__(self):
+        self._states = {}
+
+    def load(self, username):
+        return self._states.get(username)
+
+    def save(self, username, state):
+        self._states[username] = state
+
+    def delete(self, username):
+        self._states.pop(username, None)
+
+    def clear(self):
+        self._states.clear()
+
+
+class FileSessionStore():
+    """
+    One encrypted file per username in 'directory'. Anything that can't be read back
+    (missing, corrupt, written with another key) is treated as no stored session.
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, key=None):
+        self.directory = directory
+        self._key = key
+        self._fernet = None
+        self._lock = threading.Lock()
+
+    def _cipher(self):
+        # cryptography is only imported once a session is actually stored or loaded
+        with self._lock:
+            if self._fernet is None:
+                from cryptography.fernet import Fernet
+                self._fernet = Fernet(self._key or os.environ.get("BOOKINGBOT_SESSION_KEY") or derive_key())
+            return self._fernet
+
+    def _path(self, username):
+        # Usernames stay out of file names
+        return os.path.join(self.directory, hashlib.sha256(username.encode()).hexdigest()[:32])
+
+    def load(self, username):
+        try:
+            with open(self._path(username), 'rb') as f:
+                token = f.read()
+        except OSError:
+            return None
+        try:
+            return json.loads(self._cipher().decrypt(token))
+        except Exception as e:
+            print(f"Ignoring stored session for {username}: {type(e).__name__}")
+            return None
+
+    def save(self, username, state):
+        token = self._cipher().encrypt(json.dumps(state).encode())
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        path = self._path(username)
+        # Write then rename so a concurrent load never sees half a file
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(token)
+        os.replace(tmp, path)
+
+    def delete(self, username):
+        try:
+            os.remove(self._path(username))
+        except OSError:
+            pass
+
+    def clear(self):
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, name))
+
+
+def default_store():
+    """ The store configured by the environment, or None when turned off. """
+    directory = os.environ.get("BOOKINGBOT_SESSION_DIR", DEFAULT_DIR)
+    if directory.lower() in ("", "off", "none"):
+        return None
+    return FileSessionStore(directory)
@@ -1,40 +1,40 @@
-import os
+'''
+Slack bot for booking rooms from a channel: "@bot book 13:00 15:00 tomorrow".
+
+Connects over Socket Mode, so it needs no public URL. slack.json holds the bot token
+(xoxb-...) and an app level token (xapp-...) with the connections:write scope.
+
+Every mention is acknowledged straight away and the booking itself runs on a worker pool
+through bookV2. Commands from one channel run one after another in the order they were sent,
+while different channels book at the same time.
+'''
 import sys
-import time
 import re
 import json
-import book
+import asyncio
 import traceback
-import datetime as dt
-from slackclient import SlackClient
-roompref = [15,14,13,12,16,11,10,9,8]
-
-try:
-    with open('slack.json') as f:
-        token = json.load(f)
-except:
-    print("Error loading file")
-    sys.exit(0)
-
-starterbot_id = None
-slack_client = SlackClient(token['bot_token'])
+from concurrent.futures import ThreadPoolExecutor
+
+from slack_sdk.web.async_client import AsyncWebClient
+from slack_sdk.socket_mode.aiohttp import SocketModeClient
+from slack_sdk.socket_mode.response import SocketModeResponse
+
+import bookV2
+from dispatch import BOOKED
+from ranking import get_ranker
+from room_catalog import get_catalog
+
 # constants
-RTM_READ_DELAY = 1 # 1 second delay between reading from RTM
 BOOK_COMMAND = "book"
+AVAILABILITY_COMMAND = "availability"
+ROOMS_COMMAND = "rooms"
 MENTION_REGEX = "^<@(|[WU].+?)>(.*)"
+# Booking jobs running at once across all channels
+MAX_JOBS = 4
+# Availability queries answered at once, separately from the booking jobs
+MAX_QUERIES = 4
+DEFAULT_RESPONSE = "Not sure what you mean. Try *{}* or *{}* startHour:startMin endHour:endMin #days in the future.".format(BOOK_COMMAND, AVAILABILITY_COMMAND)
 
-def parse_bot_commands(slack_events):
-    """
-        Parses a list of events coming from the Slack RTM API to find bot commands.
-        If a bot command is found, this function returns a tuple of command and channel.
-        If its not found, then this function returns None, None.
-    """
-    for event in slack_events:
-        if event["type"] == "message" and not "subtype" in event:
-            user_id, message = parse_direct_mention(event["text"])
-            if user_id == starterbot_id:
-                return message, event["channel"]
-    return None, None
 
 def parse_direct_mention(message_text):
     """
@@ -45,65 +45,183 @@ def parse_direct_mention(message_text):
     # the first group contains the username, the second group contains the remaining message
     return (matches.group(1), matches.group(2).strip()) if matches else (None, None)
 
-def handle_command(command, channel):
+
+def parse_time(text):
+    """ "13:30" -> seconds since midnight """
+    hour, _, minute = text.rpartition(':')
+    return int(hour) * 3600 + int(minute) * 60
+
+
+def parse_days(text):
+    """ "today", "tomorrow" or a number of days in the future """
+    if text.lower() == 'today':
+        return 0
+    if text.lower() == 'tomorrow':
+        return 1
+    return int(text)
+
+
+def parse_book(command):
     """
-        Executes bot command if the command is known
+        Parses "book 13:00 15:00 [days]" (or "availability ...") into (start, end, days in the future).
+        Raises ValueError if it doesn't make sense.
     """
-    # Default response is help text for the user
-    default_response = "Not sure what you mean. Try *{}* startHour:startMin endHour:endMin #days in the future.".format(BOOK_COMMAND)
+    args = command.split()[1:]
+    if len(args) < 2:
+        raise ValueError("Need a start and end time")
+    start, end = parse_time(args[0]), parse_time(args[1])
+    # Make days optional and use today if not provided
+    days = parse_days(args[2]) if len(args) > 2 else 0
+    if end <= start:
+        raise ValueError("End time has to be after the start time")
+    return start, end, days
+
+
+def format_attempts(attempts):
+    """ Slack message for the result of bookV2.book_windows """
+    if attempts == "No rooms found":
+        return attempts
+    booked = [a for a in attempts if a.outcome == BOOKED]
+    if not booked:
+        return "No rooms found"
+    return "\n".join(f"Booked {a.cell} as {a.user['username']}" for a in booked)
+
+
+def format_time(seconds):
+    return f"{int(seconds // 3600)}:{int(seconds % 3600 // 60):02}"
+
+
+def format_availability(free):
+    """ Slack message for the result of bookV2.availability """
+    if not free:
+        return "No rooms found"
+    return "\n".join(
+        f"{room.name}: " + ", ".join(f"{format_time(start)}-{format_time(end)}" for start, end in runs)
+        for room, runs in free
+    )
+
 
-    # Finds and executes the given command, filling in response
-    response = None
-    # This is where you start to implement more commands!
-    if command.startswith(BOOK_COMMAND):
+def format_rooms(ranker):
+    """ Slack message listing every known room best first, with its score """
+    rooms = sorted(get_catalog().all(), key=ranker.score, reverse=True)
+    return "\n".join(
+        f"{room.name}: " + ("never booked" if not ranker.acceptable(room) else f"{ranker.score(room):.1f}")
+        for room in rooms
+    )
+
+
+class Bot():
+    """ Takes commands off Socket Mode and runs them on a worker pool, one queue per channel. """
+
+    def __init__(self, bot_token, app_token, max_jobs=MAX_JOBS):
+        self.web = AsyncWebClient(token=bot_token)
+        self.socket = SocketModeClient(app_token=app_token, web_client=self.web)
+        self.workers = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="booking")
+        # Read only queries get their own threads so they never wait behind bookings
+        self.readers = ThreadPoolExecutor(max_workers=MAX_QUERIES, thread_name_prefix="query")
+        # Answers being worked on outside the queues, kept so they aren't garbage collected
+        self.tasks = set()
+        self.bot_id = None
+        # channel -> asyncio.Queue of (command, thread ts)
+        self.queues = {}
+        self.consumers = {}
+
+    async def post(self, channel, text, thread_ts=None):
+        await self.web.chat_postMessage(channel=channel, text=text, thread_ts=thread_ts)
+
+    async def on_request(self, client, req):
+        # Slack resends anything not acknowledged within 3 seconds, so ack before doing anything
+        await client.send_socket_mode_response(SocketModeResponse(envelope_id=req.envelope_id))
+        if req.type != "events_api":
+            return
+
+        event = req.payload.get("event", {})
+        if event.get("type") != "app_mention" or "subtype" in event or "bot_id" in event:
+            return
+        user_id, command = parse_direct_mention(event.get("text", ""))
+        if user_id != self.bot_id:
+            return
+        if command.startswith(AVAILABILITY_COMMAND):
+            # Read only and usually served from the cache, no need to wait behind bookings
+            task = asyncio.create_task(self.answer(event["channel"], command, event["ts"]))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        else:
+            await self.enqueue(event["channel"], command, event["ts"])
+
+    async def enqueue(self, channel, command, ts):
+        queue = self.queues.get(channel)
+        if queue is None:
+            queue = self.queues[channel] = asyncio.Queue()
+            self.consumers[channel] = asyncio.create_task(self.consume(channel, queue))
+        if queue.qsize():
+            await self.post(channel, f"Queued behind {queue.qsize()} other request(s)", ts)
+        await queue.put((command, ts))
+
+    async def consume(self, channel, queue):
+        """ Runs the commands sent to 'channel' one at a time. """
+        while True:
+            command, ts = await queue.get()
+            try:
+                await self.answer(channel, command, ts)
+            except Exception:
+                # Eg. the reply couldn't be posted, the channel's later commands still get answered
+                traceback.print_exc()
+            finally:
+                queue.task_done()
+
+    async def answer(self, channel, command, ts):
         try:
-            startHour = int(command.split(' ')[1].rpartition(':')[0])
-            startMin = int(command.split(' ')[1].rpartition(':')[2])
-            endHour = int(command.split(' ')[2].rpartition(':')[0])
-            endMin = int(command.split(' ')[2].rpartition(':')[2])
+            response = await self.handle_command(channel, command, ts)
+        except Exception:
+            traceback.print_exc()
+            response = "Error, try something else"
+        await self.post(channel, response, ts)
 
-            startTime = dt.time(startHour, startMin)
-            endTime = dt.time(endHour, endMin)
+    async def handle_command(self, channel, command, ts):
+        """
+            Executes bot command if the command is known and returns the response text
+        """
+        # This is where you start to implement more commands!
+        if command.startswith(BOOK_COMMAND):
             try:
-                if command.split(' ')[3].lower() == 'today':
-                    delta = 0
-                elif command.split(' ')[3].lower() == 'tomorrow':
-                    delta = 1
-                else:
-                    delta = int(command.split(' ')[3])  
-            except IndexError: #Make delta optional and use today if not provided
-                delta = 0
-
-            for i in range(1,5): # Run through all the floors
-                result = book.scrapeAndBook(delta,startTime,endTime,i,roompref)
-                if result == "No rooms found":
-                    continue
-                else:
-                    response = result
-                    break
-            #having response = "No rooms found" at the end of the for loop wasn't working so here's the solution
-            if not response:
-                response = "No rooms found"
-        except Exception as e:
-             response = "Error, try something else"
-             print(e)
-
-    # Sends the response back to the channel
-    slack_client.api_call(
-        "chat.postMessage",
-        channel=channel,
-        text=response or default_response
-    )
+                start, end, days = parse_book(command)
+            except ValueError as e:
+                return f"{e}. {DEFAULT_RESPONSE}"
+            await self.post(channel, "On it, looking for rooms...", ts)
+            return await self.run_job(lambda: format_attempts(bookV2.book_windows(days, [(start, end)])))
+        if command.startswith(AVAILABILITY_COMMAND):
+            try:
+                start, end, days = parse_book(command)
+            except ValueError as e:
+                return f"{e}. {DEFAULT_RESPONSE}"
+            return await self.run_job(lambda: format_availability(bookV2.availability(days, start, end)), self.readers)
+        if command.startswith(ROOMS_COMMAND):
+            return format_rooms(get_ranker())
+        return DEFAULT_RESPONSE
+
+    async def run_job(self, job, executor=None):
+        """ Run blocking 'job' on 'executor' (the booking workers by default) without holding up the event loop. """
+        return await asyncio.get_running_loop().run_in_executor(executor or self.workers, job)
+
+    async def run(self):
+        self.bot_id = (await self.web.auth_test())["user_id"]
+        self.socket.socket_mode_request_listeners.append(self.on_request)
+        await self.socket.connect()
+        print("Bot connected and running!")
+        # Serve until the process is stopped
+        await asyncio.Event().wait()
+
+
+def load_tokens(path='slack.json'):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except:
+        print("Error loading file")
+        sys.exit(0)
+
 
 if __name__ == "__main__":
-    if slack_client.rtm_connect(with_team_state=False):
-        print("Starter Bot connected and running!")
-        # Read bot's user ID by calling Web API method `auth.test`
-        starterbot_id = slack_client.api_call("auth.test")["user_id"]
-        while True:
-            command, channel = parse_bot_commands(slack_client.rtm_read())
-            if command:
-                handle_command(command, channel)
-            time.sleep(RTM_READ_DELAY)
-    else:
-        print("Connection failed. Exception traceback printed above.")
\ No newline at end of file
+    token = load_tokens()
+    asyncio.run(Bot(token['bot_token'], token['app_token']).run())
@@ -0,0 +1,156 @@
+'''
+Books for several groups in one run instead of one deployment per group racing the others.
+
+Run: python tenants.py [tenants.json]   (see tenants-sample.json)
+
+Each tenant is a directory with its own login.json, group_names.json and snag_times.json.
+Every (date, area) page is scraped once for all of them. The rooms are then planned on one
+shared grid, a window per tenant at a time with the tenant picking first rotating from day to
+day, so no two tenants plan the same room. Submissions for all tenants go out together with
+the booking workers split evenly between them, through the same per-host rate limit, and each
+page is refetched once at the end to confirm every tenant's bookings.
+'''
+import os
+import sys
+import json
+from dataclasses import dataclass
+
+import run_trace
+from bookV2 import (
+    BOOKED, MAX_CONCURRENT_BOOKINGS, MAX_CONCURRENT_SCRAPES, Credentials, book_plan, booking_date,
+    build_index, confirm_bookings, make_session, refetch_grids, scrape, useful_areas
+)
+from dispatch import SlotClaims
+from planner import assign, plan_window
+from ranking import get_ranker
+from room_snag import parse_offsets, to_windows
+
+
+@dataclass
+class Tenant:
+    """ One group's accounts, names and wanted times. """
+    name: str
+    creds: Credentials
+    snag_times: dict
+
+    def windows(self, date):
+        """ (start, end) windows wanted on 'date', by weekday like room_snag. """
+        return to_windows(self.snag_times.get(date.strftime('%A'), []))
+
+
+def load_tenants(path):
+    """ Read tenants.json: {"tenants": [{"name": "...", "dir": "..."}]}, dirs relative to it. """
+    with open(path) as f:
+        config = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    tenants = []
+    for entry in config["tenants"]:
+        directory = os.path.join(base, entry["dir"])
+        creds = Credentials(os.path.join(directory, "login.json"), os.path.join(directory, "group_names.json"))
+        with open(os.path.join(directory, "snag_times.json")) as f:
+            snag_times = json.load(f)
+        tenants.append(Tenant(entry.get("name", entry["dir"]), creds, snag_times))
+    return tenants
+
+
+def plan_tenants(index, tenants, wanted, first=0):
+    """
+    Plan every tenant's windows on one shared SlotIndex. Tenants take turns one window at a
+    time, starting with tenants[first], and whatever one plans is gone for the rest.
+    Returns the Assignments for each tenant name.
+    """
+    ranker = get_ranker()
+    order = tenants[first:] + tenants[:first]
+    queues = {tenant.name: list(wanted[tenant.name]) for tenant in order}
+    cells = {tenant.name: [] for tenant in order}
+    while any(queues.values()):
+        for tenant in order:
+            if queues[tenant.name]:
+                start, end = queues[tenant.name].pop(0)
+                planned = plan_window(index, start, end, score=ranker.score)
+                for cell in planned:
+                    index.take(cell)
+                cells[tenant.name] += planned
+
+    assignments = {}
+    for tenant in order:
+        assignments[tenant.name], _ = assign(cells[tenant.name], tenant.creds.login['users'])
+    return assignments
+
+
+@run_trace.traced
+def book_tenants(tenants, offsets, areas=(1, 3), max_workers=MAX_CONCURRENT_BOOKINGS):
+    """
+    Book every tenant's snag times for each of 'offsets' days in the future. Returns
+    {offset: {tenant name: Attempts}}.
+    """
+    if not tenants:
+        return {}
+    areas = useful_areas(areas)
+    dates = {offset: booking_date(offset) for offset in offsets}
+    wanted = {
+        offset: {tenant.name: tenant.windows(date) for tenant in tenants}
+        for offset, date in dates.items()
+    }
+    offsets = [offset for offset in offsets if any(wanted[offset].values())]
+
+    # Each tenant gets an even share of the booking workers
+    share = max(1, max_workers // len(tenants))
+    session = make_session(MAX_CONCURRENT_SCRAPES)
+    results = {}
+    with run_trace.ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SCRAPES) as scrapers:
+        # Every page once, whoever wants it, kept until its day is planned
+        pages = {
+            offset: [
+                scrapers.submit(scrape, dates[offset].day, dates[offset].month, dates[offset].year, area, session=session)
+                for area in areas
+            ]
+            for offset in offsets
+        }
+
+        for offset in offsets:
+            date = dates[offset]
+            grids = [page.result() for page in pages[offset]]
+            with run_trace.phase("plan", offset=offset, tenants=len(tenants)):
+                index = build_index(grids)
+                plans = plan_tenants(index, tenants, wanted[offset], first=date.toordinal() % len(tenants))
+            results[offset] = book_tenants_day(tenants, plans, offset, date, index, share)
+    return results
+
+
+def book_tenants_day(tenants, plans, offset, date, index, share):
+    """ Submit every tenant's 'plans' for one day at once, then confirm them with one refetch per page. """
+    claims = SlotClaims()
+    with run_trace.ThreadPoolExecutor(max_workers=len(tenants)) as pool:
+        futures = {
+            tenant.name: pool.submit(
+                book_plan, plans[tenant.name], offset, index, max_workers=share,
+                verify=False, creds=tenant.creds, claims=claims.scoped(tenant.name)
+            )
+            for tenant in tenants
+        }
+        results = {name: future.result() for name, future in futures.items()}
+
+    # One refetch per page confirms every tenant's bookings
+    booked = {
+        name: [a for a in attempts if a.outcome == BOOKED]
+        for name, attempts in results.items() if attempts != "No rooms found"
+    }
+    areas = {a.cell.area for attempts in booked.values() for a in attempts}
+    if areas:
+        grids = refetch_grids(date, areas)
+        for tenant in tenants:
+            if booked.get(tenant.name):
+                print(f"{tenant.name}: ", end="")
+                confirm_bookings(date, booked[tenant.name], grids, tenant.creds.group_names)
+    return results
+
+
+def main(path="tenants.json", offsets=None):
+    tenants = load_tenants(path)
+    offsets = parse_offsets(offsets or os.environ.get("SNAG_OFFSETS", "7"))
+    return book_tenants(tenants, offsets)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "tenants.json")
@@ -1,3 +1,21 @@
+import copy
+from itertools import compress
+
+SLOT_SECONDS = 1800 # Rooms are booked in 30 minute slots
+MAX_BOOKING_SECONDS = 7200 # and for at most 2 hours at a time
+SLOTS_PER_DAY = 86400 // SLOT_SECONDS
+
+# DayGrid slot states
+EMPTY = 0 # Nothing on the page for this slot, eg. covered by a longer cell above it
+FREE = 1
+BOOKED = 2
+# bytes.translate tables picking out the slots in a state (any cell for None)
+_STATUS_TABLES = {
+    status: bytes(int(state != EMPTY if status is None else state == status) for state in range(256))
+    for status in (None, FREE, BOOKED)
+}
+
+
 def flatten(something):
     """ Flattens a multidimensional array. """
     if isinstance(something, (list, tuple, set, range)):
@@ -10,32 +28,46 @@ def flatten(something):
 def get_available(existing_bookings):
     """ Search the array of cells and return all that are unbooked. """
     available = []
+    seen = set()
 
     for cell in existing_bookings:
-        if (cell.group_name is None) and (cell not in available):
+        key = (cell.room_meta.id, cell.day, cell.time)
+        if (cell.group_name is None) and (key not in seen):
+            seen.add(key)
             available.append(cell)
 
     return available
 
-def sort_by_prefrence(bookings):
+def sort_by_prefrence(bookings, score=None):
     """
-    Sort rooms by their duration and then quality field. This function is pretty simple but can
-    be expaded in the future for more advanced room sorting (if you ever want it...)
+    Sort rooms by their duration and then 'score', a function scoring a room (eg.
+    ranking.Ranker.score), which defaults to its quality field.
+
+    Lists are sorted in place and returned, anything else is sorted into a new list.
     """
-    return sorted(bookings, key=lambda x: (x.duration, x.room_meta.quality), reverse=True)
+    score = score or (lambda room: room.quality)
+    key = lambda x: (x.duration, score(x.room_meta))
+    if isinstance(bookings, list):
+        bookings.sort(key=key, reverse=True)
+        return bookings
+    return sorted(bookings, key=key, reverse=True)
 
 def get_within_times(bookings, start=0, end=0):
     """
-    Return bookings that are within the given times.
+    Return bookings that are within the given times, as an iterator.
 
     eg. Between 12600 and 18000 would include 12600 <= x < 18000.
     """
-    return list(filter(lambda x: x.is_between_times(start, end), bookings))
+    if isinstance(bookings, DayGrid):
+        return bookings.iter_cells(start=start, end=end)
+    return filter(lambda x: x.is_between_times(start, end), bookings)
 
 
 def get_unbooked(bookings):
-    """ Filter all rooms already booked. """
-    return list(filter(lambda x: not x.is_booked(), bookings))
+    """ Filter all rooms already booked, as an iterator. """
+    if isinstance(bookings, DayGrid):
+        return bookings.iter_cells(FREE)
+    return filter(lambda x: not x.is_booked(), bookings)
 
 
 def get_our_bookings(existing_bookings, possible_names):
@@ -47,6 +79,10 @@ def get_our_bookings(existing_bookings, possible_names):
     """
     ours = []
 
+    if isinstance(existing_bookings, DayGrid):
+        # Only our own bookings are made into cells
+        grid = existing_bookings
+        return [grid.cell(position) for position, (group_name, _) in sorted(grid.bookings.items()) if group_name in possible_names]
     for cell in existing_bookings:
         if cell.group_name in possible_names:
             ours.append(cell)
@@ -54,7 +90,290 @@ def get_our_bookings(existing_bookings, possible_names):
     return ours
 
 
-def to_uvic_url(day, month, year, area):
+def to_uvic_url(day, month, year, area, url_base="https://webapp.library.uvic.ca/studyrooms/"):
     """ Turns the {day, month, year, area} into a url. """
-    complete_url = f"https://webapp.library.uvic.ca/studyrooms/index.php?view=day&day={day}&month={month}&year={year}&area={area}"
-    return complete_url
\ No newline at end of file
+    complete_url = f"{url_base}index.php?view=day&day={day}&month={month}&year={year}&area={area}"
+    return complete_url
+
+
+class DayGrid():
+    """
+    Every cell on one day page stored column-wise instead of as Cell objects: one row of 48
+    half hour slots per room, holding the slot's state and the length (in slots) of the cell
+    starting there. Booking ids and group names are only kept for booked cells. A booking we
+    just made has a group name but no id until the page is read again.
+
+    Cells are only made when iterating, so a long multi-area scan stays small. Queries that
+    don't need whole cells can use positions, count and locate instead.
+    """
+    __slots__ = ("area", "day", "cell_type", "rooms", "rows", "status", "length", "bookings")
+
+    def __init__(self, area, day, cell_type):
+        self.area = area
+        self.day = day
+        # Class cells are made with, eg. bookV2.Cell
+        self.cell_type = cell_type
+        self.rooms = []
+        # room id -> row number
+        self.rows = {}
+        self.status = bytearray()
+        self.length = bytearray()
+        # slot position -> (group name, booking id)
+        self.bookings = {}
+
+    @classmethod
+    def from_cells(cls, cells, area=None, day=None, cell_type=None):
+        """
+        Grid holding 'cells'. The area, day and cell type come from the first cell unless
+        given, so an empty page needs them passed in.
+        """
+        cells = iter(cells)
+        first = next(cells, None)
+        if first is not None:
+            area = first.area if area is None else area
+            day = first.day if day is None else day
+            cell_type = cell_type or type(first)
+        grid = cls(area, day, cell_type)
+        if first is not None:
+            grid.add(first)
+            for cell in cells:
+                grid.add(cell)
+        return grid
+
+    def add(self, cell):
+        self.set(cell.room_meta, cell.time, cell.duration, cell.group_name, cell.booking_id)
+
+    def copy(self):
+        grid = DayGrid(self.area, self.day, self.cell_type)
+        grid.rooms = list(self.rooms)
+        grid.rows = dict(self.rows)
+        grid.status = bytearray(self.status)
+        grid.length = bytearray(self.length)
+        grid.bookings = dict(self.bookings)
+        return grid
+
+    def with_booking(self, cell, group_name, booking_id=None):
+        """ A new grid with 'cell' booked by 'group_name', replacing whatever it covers. """
+        grid = self.copy()
+        base = grid.row(cell.room_meta) * SLOTS_PER_DAY
+        first = int(cell.time) // SLOT_SECONDS
+        last = min(SLOTS_PER_DAY, -(-int(cell.time + cell.duration) // SLOT_SECONDS))
+        for position in range(base + first, base + last):
+            grid.status[position] = EMPTY
+            grid.length[position] = 0
+            grid.bookings.pop(position, None)
+        grid.set(cell.room_meta, cell.time, cell.duration, group_name, booking_id)
+        return grid
+
+    def without(self, predicate):
+        """ A new grid holding every cell of this one except those matching 'predicate'. """
+        grid = DayGrid(self.area, self.day, self.cell_type)
+        for room in self.rooms:
+            grid.row(room)
+        for cell in self:
+            if not predicate(cell):
+                grid.add(cell)
+        return grid
+
+    def row(self, room):
+        """ Row number for 'room', adding a row if it's new. """
+        row = self.rows.get(room.id)
+        if row is None:
+            row = self.rows[room.id] = len(self.rooms)
+            self.rooms.append(room)
+            self.status.extend(bytes(SLOTS_PER_DAY))
+            self.length.extend(bytes(SLOTS_PER_DAY))
+        return row
+
+    def set(self, room, time, duration, group_name=None, booking_id=None):
+        """ Store a cell. Booked cells are the ones with a booking id or a group name. """
+        position = self.row(room) * SLOTS_PER_DAY + int(time) // SLOT_SECONDS
+        booked = booking_id is not None or group_name is not None
+        self.status[position] = BOOKED if booked else FREE
+        self.length[position] = int(duration) // SLOT_SECONDS
+        if booked:
+            self.bookings[position] = (group_name, booking_id)
+
+    def __len__(self):
+        return len(self.status) - self.status.count(EMPTY)
+
+    def free_mask(self, room_id):
+        """ Bitmap of the free slots of 'room_id', as used by SlotIndex. """
+        row = self.rows.get(room_id)
+        if row is None:
+            return 0
+        mask = 0
+        base = row * SLOTS_PER_DAY
+        position = self.status.find(FREE, base, base + SLOTS_PER_DAY)
+        while position != -1:
+            mask |= ((1 << self.length[position]) - 1) << (position - base)
+            position = self.status.find(FREE, position + 1, base + SLOTS_PER_DAY)
+        return mask
+
+    def cell_at(self, room_id, time):
+        """ The cell covering 'time' in 'room_id', which may have started in an earlier slot. """
+        row = self.rows.get(room_id)
+        if row is None:
+            return None
+        base = row * SLOTS_PER_DAY
+        slot = int(time) // SLOT_SECONDS
+        for start in range(slot, -1, -1):
+            if self.status[base + start] != EMPTY:
+                if start + self.length[base + start] > slot:
+                    return self.cell(base + start)
+                return None
+        return None
+
+    def cell(self, position):
+        row, slot = divmod(position, SLOTS_PER_DAY)
+        group_name, booking_id = self.bookings.get(position, (None, None))
+        return self.cell_type(
+            self.rooms[row], group_name, booking_id, self.area, self.day,
+            slot * SLOT_SECONDS, self.length[position] * SLOT_SECONDS
+        )
+
+    def positions(self, status=None, start=0, end=86400):
+        """
+        Positions (row * SLOTS_PER_DAY + slot, see locate and cell) of the cells starting in
+        [start, end), room by room, optionally only those in 'status'. No cells are made.
+        """
+        first = -(-int(start) // SLOT_SECONDS)
+        last = min(SLOTS_PER_DAY, -(-int(end) // SLOT_SECONDS))
+        # A 1 for every slot wanted, a 0 for the rest
+        wanted = self.status.translate(_STATUS_TABLES[status])
+        if first > 0 or last < SLOTS_PER_DAY:
+            before, after = bytes(first), bytes(SLOTS_PER_DAY - last)
+            for base in range(0, len(wanted), SLOTS_PER_DAY):
+                wanted[base:base + first] = before
+                wanted[base + last:base + SLOTS_PER_DAY] = after
+        return list(compress(range(len(wanted)), wanted))
+
+    def count(self, status):
+        """ How many cells are in 'status'. """
+        return self.status.count(status)
+
+    def locate(self, position):
+        """ (room, time, duration) of the cell at 'position'. """
+        row, slot = divmod(position, SLOTS_PER_DAY)
+        return self.rooms[row], slot * SLOT_SECONDS, self.length[position] * SLOT_SECONDS
+
+    def iter_cells(self, status=None, start=0, end=86400):
+        """
+        The cells starting in [start, end), room by room, optionally only those in 'status'.
+        Each cell is only made once it's iterated to.
+        """
+        return map(self.cell, self.positions(status, start, end))
+
+    def __iter__(self):
+        return self.iter_cells()
+
+
+def mask_runs(mask):
+    """ The runs of set bits in a slot bitmap as (start, end) tuples in seconds. """
+    # A run starts on a set bit whose lower neighbour isn't set and ends on one whose upper isn't
+    starts = mask & ~(mask << 1)
+    ends = mask & ~(mask >> 1)
+    runs = []
+    while starts:
+        first = (starts & -starts).bit_length() - 1
+        last = (ends & -ends).bit_length() - 1
+        starts &= starts - 1
+        ends &= ends - 1
+        runs.append((first * SLOT_SECONDS, (last + 1) * SLOT_SECONDS))
+    return runs
+
+
+def slot_mask(start, end):
+    """ Bitmask with a bit set for every slot starting in [start, end). """
+    first = -(-int(start) // SLOT_SECONDS)
+    last = -(-int(end) // SLOT_SECONDS)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+class SlotIndex():
+    """
+    Free half hour slots of every room on one day, stored as a bitmap per room.
+
+    Bit n of a room's mask is set when the slot starting n * 30 minutes after midnight is free,
+    so checking a slot is a single bit test and whole ranges are checked with one mask.
+    """
+
+    def __init__(self):
+        # room id -> bitmap of free slots
+        self.free = {}
+        # room id -> a cell in that room, copied when handing out cells
+        self.templates = {}
+
+    @classmethod
+    def from_grids(cls, grids):
+        """ Build an index straight from DayGrids (eg. every area of a day) without making cells. """
+        index = cls()
+        for grid in grids:
+            for room_id, row in grid.rows.items():
+                free = grid.free_mask(room_id)
+                if free:
+                    index.free[room_id] = free
+                    first = (free & -free).bit_length() - 1
+                    index.templates[room_id] = grid.cell(row * SLOTS_PER_DAY + first)
+        return index
+
+    @classmethod
+    def from_cells(cls, cells):
+        """ Build an index from the unbooked cells in 'cells'. """
+        index = cls()
+        for cell in cells:
+            if not cell.is_booked():
+                index.add(cell)
+        return index
+
+    def take(self, cell):
+        """ Mark the slots 'cell' covers as no longer free, eg. once it's been booked. """
+        room_id = cell.room_meta.id
+        if room_id in self.free:
+            self.free[room_id] &= ~slot_mask(cell.time, cell.time + cell.duration)
+
+    def discard(self, room_id):
+        """ Forget 'room_id' entirely, eg. a room we never want. """
+        self.free.pop(room_id, None)
+        self.templates.pop(room_id, None)
+
+    def add(self, cell):
+        """ Mark every slot covered by a free cell. """
+        room_id = cell.room_meta.id
+        if room_id not in self.templates:
+            self.templates[room_id] = cell
+            self.free[room_id] = 0
+        self.free[room_id] |= slot_mask(cell.time, cell.time + cell.duration)
+
+    def is_free(self, room_id, time):
+        return bool(self.free.get(room_id, 0) >> (int(time) // SLOT_SECONDS) & 1)
+
+    def is_free_between(self, room_id, start, end):
+        """ True if 'room_id' is free for the whole of [start, end). """
+        mask = slot_mask(start, end)
+        return self.free.get(room_id, 0) & mask == mask
+
+    def rooms_free_between(self, start, end):
+        """ Ids of every room free for the whole of [start, end). """
+        mask = slot_mask(start, end)
+        return [room_id for room_id, free in self.free.items() if free & mask == mask]
+
+    def runs(self, room_id, start=0, end=86400, max_duration=MAX_BOOKING_SECONDS):
+        """
+        Maximal runs of free slots in [start, end) for 'room_id' as (time, duration) tuples.
+        Runs longer than 'max_duration' are split up.
+        """
+        runs = []
+        for first, last in mask_runs(self.free.get(room_id, 0) & slot_mask(start, end)):
+            for chunk in range(first, last, max_duration):
+                runs.append((chunk, min(max_duration, last - chunk)))
+        return runs
+
+    def cell(self, room_id, time, duration):
+        """ A free cell for 'room_id' at 'time' lasting 'duration' seconds. """
+        cell = copy.copy(self.templates[room_id])
+        cell.time = time
+        cell.duration = duration
+        return cell
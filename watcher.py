@@ -0,0 +1,192 @@
+'''
+Watches for cancellations and books rooms the moment they free up.
+
+Run: python watcher.py [watch.json]   (see watch-sample.json)
+
+Each watch is a date and time range we want covered. The pages for those dates are polled,
+faster as the time gets close and backing off while nothing changes, and whenever a room in
+a watched range frees up it is booked through make_booking straight away.
+'''
+import sys
+import json
+import time
+import datetime as dt
+from dataclasses import dataclass
+
+import pytz
+
+from bookV2 import make_booking
+from incremental import IncrementalScraper
+from planner import plan_window
+from ranking import get_ranker
+from utils import SlotIndex, mask_runs, slot_mask
+
+PACIFIC = pytz.timezone('US/Pacific')
+# Poll interval bounds, in seconds
+MIN_INTERVAL = 20
+MAX_INTERVAL = 15 * 60
+# Interval is the time left until the booking divided by this, so it shrinks as the time nears
+INTERVAL_DIVISOR = 100
+# Each poll in a row that sees no change stretches the interval by this much, up to MAX_INTERVAL
+BACKOFF = 1.5
+# Never hit the site more often than this, whatever the watches want
+MIN_REQUEST_GAP = 2.0
+
+
+@dataclass
+class Watch:
+    """ A time range on one day we'd like a room for. """
+    date: dt.date
+    start: int
+    end: int
+    # Bitmap of slots we've booked so far
+    covered: int = 0
+    # Polls in a row that saw nothing change
+    quiet_polls: int = 0
+    next_poll: float = 0.0
+
+    def starts_at(self):
+        """ When the watched range starts, as a unix time. """
+        midnight = PACIFIC.localize(dt.datetime.combine(self.date, dt.time()))
+        return midnight.timestamp() + self.start
+
+    def wanted(self):
+        """ Bitmap of the slots still wanted. """
+        return slot_mask(self.start, self.end) & ~self.covered
+
+    def remaining(self):
+        """ The uncovered parts of the range as (start, end) tuples. """
+        return mask_runs(self.wanted())
+
+    def done(self, now):
+        return not self.wanted() or now >= self.starts_at()
+
+
+def poll_interval(watch, now):
+    """ Seconds until 'watch' should be polled again. """
+    interval = (watch.starts_at() - now) / INTERVAL_DIVISOR
+    interval *= BACKOFF ** watch.quiet_polls
+    return min(MAX_INTERVAL, max(MIN_INTERVAL, interval))
+
+
+def load_watches(path):
+    """
+    Read watches from a JSON file like watch-sample.json. Dates are either "date": "YYYY-MM-DD"
+    or "days_in_future": n.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    today = dt.datetime.now(PACIFIC).date()
+    watches = []
+    for entry in config["watches"]:
+        if "date" in entry:
+            date = dt.date.fromisoformat(entry["date"])
+        else:
+            date = today + dt.timedelta(days=entry["days_in_future"])
+        start_h, start_m = map(int, entry["bookingStart"].split(':'))
+        end_h, end_m = map(int, entry["bookingEnd"].split(':'))
+        watches.append(Watch(date, start_h * 3600 + start_m * 60, end_h * 3600 + end_m * 60))
+    return watches, tuple(config.get("areas", (1, 3)))
+
+
+class Watcher():
+    """ Polls the pages the watches need and books freed rooms that match them. """
+
+    def __init__(self, watches, areas=(1, 3), scraper=None, book=make_booking, clock=time.time, sleep=time.sleep):
+        self.watches = list(watches)
+        self.areas = areas
+        self.scraper = scraper or IncrementalScraper()
+        self.book = book
+        self.clock = clock
+        self.sleep = sleep
+        self._last_request = 0.0
+
+    def wait_for_rate_limit(self):
+        gap = self._last_request + MIN_REQUEST_GAP - self.clock()
+        if gap > 0:
+            self.sleep(gap)
+        self._last_request = self.clock()
+
+    def grid(self, date):
+        """ SlotIndex of every free room on 'date' as of the last polls. """
+        index = SlotIndex()
+        ranker = get_ranker()
+        for area in self.areas:
+            state = self.scraper.pages.get((date, area))
+            if state is not None:
+                for cell in state.free.values():
+                    if ranker.acceptable(cell.room_meta):
+                        index.add(cell)
+        return index
+
+    def book_watch(self, watch, index, now):
+        """ Book whatever is free in 'index' in the uncovered parts of 'watch'. """
+        cells = []
+        for start, end in watch.remaining():
+            cells += plan_window(index, start, end, score=get_ranker().score)
+        if not cells:
+            return
+
+        today = dt.datetime.fromtimestamp(now, PACIFIC).date()
+        booked = self.book(cells, (watch.date - today).days)
+        if booked == "No rooms found":
+            return
+        for cell in booked:
+            mask = slot_mask(cell.time, cell.time + cell.duration)
+            watch.covered |= mask
+            # Don't offer the same room to another watch on this date
+            index.take(cell)
+        if booked:
+            # The page changed under us, read it in full next time
+            self.scraper.forget(watch.date)
+
+    def poll_date(self, date, watches):
+        """ Poll every area on 'date' and book for 'watches' if anything changed. Returns whether it did. """
+        changed = False
+        for area in self.areas:
+            self.wait_for_rate_limit()
+            changed = self.scraper.poll(date, area).changed() or changed
+
+        # Only look for rooms to book when something actually changed
+        if changed:
+            index = self.grid(date)
+            for watch in watches:
+                self.book_watch(watch, index, self.clock())
+        return changed
+
+    def step(self):
+        """ Poll every date with a watch due and book what freed up. Returns when to wake next. """
+        now = self.clock()
+        self.watches = [w for w in self.watches if not w.done(now)]
+        due = [w for w in self.watches if w.next_poll <= now]
+
+        for date in sorted({w.date for w in due}):
+            watches = [w for w in due if w.date == date]
+            try:
+                changed = self.poll_date(date, watches)
+            except Exception as e:
+                # Site down, a maintenance page, a session that won't log in... try again later
+                print(f"Polling {date} failed: {type(e).__name__}: {e}")
+                # Read the pages in full next time so nothing freed meanwhile is missed
+                self.scraper.forget(date)
+                changed = False
+            for watch in watches:
+                watch.quiet_polls = 0 if changed else watch.quiet_polls + 1
+                watch.next_poll = self.clock() + poll_interval(watch, self.clock())
+
+        if not self.watches:
+            return None
+        return min(w.next_poll for w in self.watches)
+
+    def run(self):
+        """ Keep polling until every watch is covered or has started. """
+        while True:
+            wake = self.step()
+            if wake is None:
+                return
+            self.sleep(max(0.0, wake - self.clock()))
+
+
+if __name__ == "__main__":
+    watches, areas = load_watches(sys.argv[1] if len(sys.argv) > 1 else "watch.json")
+    Watcher(watches, areas).run()